@@ -0,0 +1,446 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from ColumnStore import ColumnTable, IntColumn, read_csv
+from DataModel import table_schemas, table_indexes
+from Profiling import span
+from SqliteStore import SqliteTable, connect
+from Validation import KeySet, sorted_unique
+
+# Key of a missing int value, text columns use their code -1
+MISSING = np.iinfo(np.int64).min
+# Distinct (group, person) pairs are kept as one int64: the group number in
+# the high bits, the person's rank among the persons seen so far in the low
+# PERSON_BITS, so any person id fits
+PERSON_BITS = 32
+RANKS = (1 << PERSON_BITS) - 1
+# Donors are the persons with a sample in this table and column
+DONORS = ('sprec', 'person_id')
+
+
+def table_marks(table):
+    # What a cached result was computed from. Appends leave the edits count
+    # alone, so a larger size with the same edits only means new rows.
+    return table, table.edits, table.size
+
+
+def decode_keys(column, keys):
+    if isinstance(column, IntColumn):
+        missing = keys == MISSING
+        return pd.arrays.IntegerArray(np.where(missing, 0, keys), missing)
+    # Code -1 picks the trailing None
+    return np.array(column.categories[:int(keys.max(initial=-1)) + 1] + [None], dtype=object)[keys]
+
+
+def padded(counts, size):
+    # Counts grown with zeros for groups seen for the first time
+    if len(counts) >= size:
+        return counts
+    return np.concatenate((counts, np.zeros(size - len(counts), dtype=np.int64)))
+
+
+def group_rows(keys):
+    # Group number of every row and the key values of each group. The keys
+    # are hashed column by column, then as one combined code, never sorted.
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    uniques = []
+    for key in keys:
+        codes, values = pd.factorize(key)
+        combined = combined * len(values) + codes
+        uniques.append(values)
+    local, groups = pd.factorize(combined)
+    group_keys = []
+    for values in reversed(uniques):
+        groups, codes = np.divmod(groups, len(values))
+        group_keys.append(values[codes])
+    return local, group_keys[::-1]
+
+
+class Column:
+    # Groups by a column of the summarized table
+
+    def __init__(self, name):
+        self.name = name
+        self.label = name
+
+    def parents(self):
+        return []
+
+    def keys(self, tables, table, row_ids):
+        column = table.columns[self.name]
+        if isinstance(column, IntColumn):
+            return np.where(column.valid[row_ids], column.values[row_ids], MISSING)
+        return column.codes[row_ids].astype(np.int64)
+
+    def decode(self, tables, table, keys):
+        return decode_keys(table.columns[self.name], keys)
+
+    def sql(self, alias, number):
+        return f'{alias}.{self.name}', ''
+
+
+class Year(Column):
+    # Groups by the year of a YYYY-MM-DD text column, worked out once per
+    # distinct date rather than per row
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.label = name[:-len('_date')] + '_year' if name.endswith('_date') else name + '_year'
+        self.column = None
+        self.years = np.zeros(0, dtype=np.int64)
+
+    def keys(self, tables, table, row_ids):
+        column = table.columns[self.name]
+        if column is not self.column:
+            self.column, self.years = column, np.zeros(0, dtype=np.int64)
+        known = len(self.years)
+        if known < len(column.categories):
+            added = pd.Series(column.categories[known:], dtype=object).str[:4]
+            years = pd.to_numeric(added, errors='coerce').fillna(MISSING).to_numpy(dtype=np.int64)
+            self.years = np.concatenate((self.years, years))
+        # Code -1 picks the trailing MISSING
+        return np.append(self.years, MISSING)[column.codes[row_ids]]
+
+    def decode(self, tables, table, keys):
+        missing = keys == MISSING
+        return pd.arrays.IntegerArray(np.where(missing, 0, keys), missing)
+
+    def sql(self, alias, number):
+        return f'CAST(substr({alias}.{self.name}, 1, 4) AS INTEGER)', ''
+
+
+class Joined:
+    # Groups by a column of the referenced row, e.g. the gender of a
+    # sample's donor: via is looked up among the parent's parent_key values
+
+    def __init__(self, via, parent, parent_key, name):
+        self.via = via
+        self.parent = parent
+        self.parent_key = parent_key
+        self.name = name
+        self.label = name
+        self.index = None
+
+    def parents(self):
+        return [self.parent]
+
+    def lookup(self, parent):
+        # Sorted parent keys and their row ids, kept until the parent changes
+        marks = table_marks(parent)
+        if self.index is None or self.index[0] != marks:
+            column = parent.columns[self.parent_key]
+            row_ids = parent.row_ids()
+            row_ids = row_ids[column.valid[row_ids]]
+            order = np.argsort(column.values[row_ids], kind='stable')
+            self.index = (marks, column.values[row_ids[order]], row_ids[order])
+        return self.index[1], self.index[2]
+
+    def keys(self, tables, table, row_ids):
+        parent = tables[self.parent]
+        target = Column(self.name)
+        missing = MISSING if isinstance(parent.columns[self.name], IntColumn) else -1
+        keys = np.full(len(row_ids), missing, dtype=np.int64)
+        parent_keys, parent_rows = self.lookup(parent)
+        if not len(parent_keys):
+            return keys
+        via = table.columns[self.via]
+        values = via.values[row_ids]
+        positions = np.minimum(np.searchsorted(parent_keys, values), len(parent_keys) - 1)
+        found = via.valid[row_ids] & (parent_keys[positions] == values)
+        keys[found] = target.keys(tables, parent, parent_rows[positions[found]])
+        return keys
+
+    def decode(self, tables, table, keys):
+        return decode_keys(tables[self.parent].columns[self.name], keys)
+
+    def sql(self, alias, number):
+        join = f'j{number}'
+        return (f'{join}.{self.name}',
+                f'LEFT JOIN {self.parent} {join} ON {join}.{self.parent_key} = {alias}.{self.via}')
+
+
+class Summary:
+    # Cached group-by over one table: rows per group and, with distinct, the
+    # persons per group and how many of them are donors. Rows appended since
+    # the last result are folded into the cached counts; edits, deletions, a
+    # reloaded table or a change to a joined table rebuild them.
+
+    def __init__(self, title, table, keys, count, distinct=None, sampled=None, labels=None):
+        # distinct: (person column, heading); sampled: heading of the donor count
+        # labels: {key column: (table, its key column, column shown next to the key)}
+        self.title = title
+        self.table = table
+        self.keys = keys
+        self.count = count
+        self.distinct = distinct
+        self.sampled = sampled
+        self.labels = dict(labels or {})
+        self.frame = None
+        self.frame_marks = None
+        self.reset()
+
+    def reset(self):
+        self.marks = None
+        self.groups = {}
+        self.group_keys = [[] for _ in self.keys]
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.distinct_counts = np.zeros(0, dtype=np.int64)
+        self.persons = KeySet(np.zeros(0, dtype=np.int64))
+        self.pairs = KeySet(np.zeros(0, dtype=np.int64))
+        self.added_pairs = []
+        self.sampled_counts = np.zeros(0, dtype=np.int64)
+        self.donor_marks = None
+
+    def tables(self):
+        # Every table the result depends on
+        names = [self.table] + [parent for key in self.keys for parent in key.parents()]
+        names += [parent for parent, _, _ in self.labels.values()]
+        if self.sampled:
+            names.append(DONORS[0])
+        return list(dict.fromkeys(names))
+
+    def result(self, tables, donors=None, conn=None):
+        # donors: callable returning the KeySet of donor person ids
+        # conn: a connection of the calling thread to the SqliteTables' database
+        table = tables[self.table]
+        with span('summary', title=self.title) as timed:
+            if isinstance(table, SqliteTable):
+                frame = self.run_sql(conn or table.conn)
+            else:
+                frame_marks = [table_marks(tables[name]) for name in self.tables()]
+                if frame_marks != self.frame_marks:
+                    self.update(tables)
+                    self.frame = self.to_frame(tables, donors)
+                    self.frame_marks = frame_marks
+                frame = self.frame
+            timed.set(rows=len(frame))
+        return frame
+
+    def update(self, tables):
+        table = tables[self.table]
+        edits, size = table.edits, table.size
+        parents = [table_marks(tables[parent]) for key in self.keys for parent in key.parents()]
+        if self.marks is None or self.marks[0] is not table or self.marks[1] != edits or self.marks[3] != parents:
+            self.reset()
+            start = 0
+        else:
+            start = self.marks[2]
+        if size > start:
+            self.fold(tables, table, start + np.flatnonzero(table.alive[start:size]))
+        self.marks = (table, edits, size, parents)
+
+    def group(self, key):
+        number = self.groups.get(key)
+        if number is None:
+            number = self.groups[key] = len(self.groups)
+            for values, value in zip(self.group_keys, key):
+                values.append(value)
+        return number
+
+    def fold(self, tables, table, row_ids):
+        if not len(row_ids):
+            return
+        local, group_keys = group_rows([key.keys(tables, table, row_ids) for key in self.keys])
+        groups = np.array([self.group(key) for key in zip(*(values.tolist() for values in group_keys))],
+                          dtype=np.int64)
+        self.counts = padded(self.counts, len(self.groups))
+        self.counts[groups] += np.bincount(local, minlength=len(groups))
+        if self.distinct:
+            column = table.columns[self.distinct[0]]
+            valid = column.valid[row_ids]
+            # Only the distinct persons are sorted and looked up
+            codes, persons = pd.factorize(column.values[row_ids][valid])
+            order = np.argsort(persons)
+            persons = persons[order]
+            self.add_persons(persons)
+            ranks = np.empty(len(persons), dtype=np.int64)
+            ranks[order] = np.searchsorted(self.persons.values, persons)
+            ranks = ranks[codes]
+            pairs = sorted_unique((groups[local[valid]] << PERSON_BITS) | ranks)
+            pairs = pairs[~self.pairs.contains(pairs)]
+            self.pairs.values = np.insert(self.pairs.values, np.searchsorted(self.pairs.values, pairs), pairs)
+            # Split right away, later persons change the ranks
+            self.added_pairs.append(self.split(pairs))
+            self.distinct_counts = padded(self.distinct_counts, len(self.groups))
+            self.distinct_counts += np.bincount(pairs >> PERSON_BITS, minlength=len(self.groups))
+
+    def add_persons(self, persons):
+        # persons: sorted and distinct. The kept pairs' ranks move up by the
+        # new persons sorted before them, which leaves the pairs in order.
+        added = persons[~self.persons.contains(persons)]
+        if not len(added):
+            return
+        if len(self.pairs) > 0:
+            ranks = self.pairs.values & RANKS
+            self.pairs.values = self.pairs.values + np.searchsorted(added, self.persons.values[ranks])
+        self.persons.add(added)
+        if len(self.persons) > RANKS:
+            raise ValueError(f"more than {RANKS} distinct {self.distinct[0]} values")
+
+    def split(self, pairs):
+        # (group numbers, person ids) of pairs
+        return pairs >> PERSON_BITS, self.persons.values[pairs & RANKS]
+
+    @staticmethod
+    def donor_groups(groups, persons, donors):
+        # Groups of the pairs whose person is a donor
+        # np.isin looks person ids up in a table when their range allows it
+        return groups[np.isin(persons, donors.values)]
+
+    def to_frame(self, tables, donors):
+        table = tables[self.table]
+        count = len(self.groups)
+        frame = pd.DataFrame({key.label: key.decode(tables, table, np.array(values, dtype=np.int64))
+                              for key, values in zip(self.keys, self.group_keys)})
+        for key, (parent, parent_key, name) in self.labels.items():
+            parent = tables[parent]
+            names = pd.Series(parent.values(name).to_numpy(dtype=object),
+                              index=parent.values(parent_key).to_numpy(dtype=object))
+            names = names[~names.index.duplicated()]
+            frame.insert(frame.columns.get_loc(key) + 1, name, frame[key].astype(object).map(names))
+        frame[self.count] = self.counts[:count]
+        if self.distinct:
+            frame[self.distinct[1]] = self.distinct_counts
+        if self.sampled:
+            donor_marks = table_marks(tables[DONORS[0]])
+            if donor_marks != self.donor_marks:
+                # New donors can be in any group, all pairs are looked up again
+                self.sampled_counts = np.zeros(count, dtype=np.int64)
+                self.added_pairs = [self.split(self.pairs.values)]
+            else:
+                self.sampled_counts = padded(self.sampled_counts, count)
+            donor_set = donors()
+            for groups, persons in self.added_pairs:
+                self.sampled_counts += np.bincount(self.donor_groups(groups, persons, donor_set), minlength=count)
+            self.donor_marks = donor_marks
+            frame[self.sampled] = self.sampled_counts
+        self.added_pairs = []
+        frame = frame[frame[self.count] > 0]
+        return frame.sort_values([key.label for key in self.keys], na_position='last', ignore_index=True)
+
+    def run_sql(self, conn):
+        # SQLite groups through its own indexes, nothing is cached here
+        keys, joins = [], []
+        for number, key in enumerate(self.keys):
+            expression, join = key.sql('t', number)
+            keys.append((expression, key.label))
+            if join:
+                joins.append(join)
+        selects = []
+        for expression, label in keys:
+            selects.append(f'{expression} AS {label}')
+            if label in self.labels:
+                parent, parent_key, name = self.labels[label]
+                joins.append(f'LEFT JOIN {parent} l_{label} ON l_{label}.{parent_key} = {expression}')
+                selects.append(f'MIN(l_{label}.{name}) AS {name}')
+        selects.append(f'COUNT(*) AS {self.count}')
+        if self.distinct:
+            person = f't.{self.distinct[0]}'
+            selects.append(f'COUNT(DISTINCT {person}) AS {self.distinct[1]}')
+            if self.sampled:
+                selects.append(f'COUNT(DISTINCT CASE WHEN {person} IN (SELECT {DONORS[1]} FROM {DONORS[0]}) '
+                               f'THEN {person} END) AS {self.sampled}')
+        groups = ', '.join(expression for expression, _ in keys)
+        order = ', '.join(f'{expression} IS NULL, {expression}' for expression, _ in keys)
+        sql = (f'SELECT {", ".join(selects)} FROM {self.table} t {" ".join(joins)} '
+               f'GROUP BY {groups} ORDER BY {order}')
+        frame = pd.read_sql_query(sql, conn)
+        for key in self.keys:
+            # Integer keys with a NULL group come back as floats
+            if pd.api.types.is_float_dtype(frame[key.label]):
+                frame[key.label] = frame[key.label].astype('Int64')
+        return frame
+
+
+def default_summaries():
+    return [
+        Summary('Samples per biobank', 'sprec',
+                [Column('biobank_id'), Column('sample_type'), Column('storage_temp')],
+                count='samples', distinct=('person_id', 'donors'),
+                labels={'biobank_id': ('miabis', 'biobank_id', 'biobank_name')}),
+        Summary('Samples per donor gender', 'sprec',
+                [Joined('person_id', 'omop_person', 'person_id', 'gender_concept_id'), Column('sample_type')],
+                count='samples', distinct=('person_id', 'donors')),
+        Summary('Patients per condition', 'condition_occurrence', [Column('condition_concept_id')],
+                count='occurrences', distinct=('person_id', 'patients'), sampled='patients_with_samples'),
+        Summary('Procedures per year', 'procedure_occurrence', [Year('procedure_date')],
+                count='procedures', distinct=('person_id', 'patients'), sampled='patients_with_samples'),
+    ]
+
+
+class Aggregator:
+    # The summaries of a set of tables, cached between calls. The same
+    # instance has to be reused for the incremental updates to pay off.
+
+    def __init__(self, summaries=None):
+        self.summaries = {summary.title: summary for summary in summaries or default_summaries()}
+        self.donor_keys = None
+
+    def titles(self):
+        return list(self.summaries)
+
+    def donors(self, tables):
+        table = tables[DONORS[0]]
+        marks = table_marks(table)
+        if self.donor_keys is None or self.donor_keys[0] != marks:
+            self.donor_keys = (marks, KeySet(table.values(DONORS[1])))
+        return self.donor_keys[1]
+
+    def result(self, title, tables, conn=None):
+        # tables: {table name: ColumnTable or SqliteTable}
+        return self.summaries[title].result(tables, lambda: self.donors(tables), conn)
+
+    def results(self, tables):
+        return {title: self.result(title, tables) for title in self.summaries}
+
+
+def open_tables(storage, directory='.', database='biobank.db'):
+    # The stored tables, read as the app would; missing CSV and Feather files are empty tables
+    if storage == 'sqlite':
+        conn = connect(database)
+        return {name: SqliteTable(conn, name, schema) for name, schema in table_schemas.items()}
+    tables = {}
+    for name, schema in table_schemas.items():
+        if storage == 'feather':
+            from FeatherStore import feather_path, open_table
+            path = feather_path(directory, name)
+            load = lambda: open_table(path, schema, table_indexes.get(name, ()))
+        else:
+            path = os.path.join(directory, f'{name}_data.csv')
+            load = lambda: read_csv(path, schema, indexes=table_indexes.get(name, ()))
+        tables[name] = load() if os.path.exists(path) else ColumnTable(schema, table_indexes.get(name, ()))
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the cohort summaries of the stored tables")
+    parser.add_argument('--storage', choices=['csv', 'feather', 'sqlite'], default='csv',
+                        help="storage backend to read")
+    parser.add_argument('--data-dir', default='.', help="directory of the CSV or Feather table files")
+    parser.add_argument('--database', default='biobank.db', help="SQLite database file for --storage sqlite")
+    parser.add_argument('--out-dir', help="also write every summary to <out-dir>/<summary>.csv")
+    parser.add_argument('--rows', type=int, default=20, help="rows printed per summary")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tables = open_tables(args.storage, args.data_dir, args.database)
+    print(f"Opened {sum(len(table) for table in tables.values())} rows in {time.perf_counter() - start:.2f}s")
+    aggregator = Aggregator()
+    for title in aggregator.titles():
+        start = time.perf_counter()
+        frame = aggregator.result(title, tables)
+        print(f"\n{title}: {len(frame)} groups in {time.perf_counter() - start:.2f}s")
+        print(frame.head(args.rows).to_string(index=False))
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+            frame.to_csv(os.path.join(args.out_dir, title.lower().replace(' ', '_') + '.csv'), sep=';', index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from ColumnStore import read_csv
+from DataModel import table_schemas, table_indexes
+from FeatherStore import convert_csv, feather_path, open_table
+from Profiling import current_rss
+from SyntheticData import write_dataset
+
+# tkinter, VirtualTable and BiobankApp are imported once it is known whether
+# a display is available, see open_tk
+
+# A measurement slower or hungrier than the baseline by more than this fraction is a regression
+TOLERANCE = 0.25
+# Differences below these are noise, whatever the fraction
+MIN_SECONDS = 0.005
+MIN_MB = 16
+
+
+def reset_peak_rss():
+    # Linux only: restarts the peak RSS count at the current RSS
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    # Peak resident set size in bytes since reset_peak_rss()
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return current_rss()
+
+
+def open_tk(headless=False):
+    # A hidden Tk root, or the HeadlessTk stand-in without a display
+    if not headless:
+        import tkinter as tk
+        try:
+            root = tk.Tk()
+            root.withdraw()
+            return root, False
+        except tk.TclError:
+            print("No display, running with the headless Tk stand-in", file=sys.stderr)
+    import HeadlessTk
+    return HeadlessTk.install().Tk(), True
+
+
+def bench_incremental_add(root, existing_rows, adds):
+    # Per-add latency should stay flat whatever the number of existing rows
+    from VirtualTable import VirtualTreeview
+    results = []
+    for n in existing_rows:
+        data = [{'person_id': str(i % 5000), 'value': str(i)} for i in range(n)]
+        table = VirtualTreeview(root, columns=['person_id', 'value'], show='headings')
+        table.set_source(range(len(data)), lambda page: [list(data[i].values()) for i in page])
+
+        start = time.perf_counter()
+        for i in range(adds):
+            data.append({'person_id': str(i % 5000), 'value': str(n + i)})
+            table.append_row(len(data) - 1, see=True)
+        table.update_idletasks()
+        elapsed = time.perf_counter() - start
+
+        results.append((n, elapsed / adds))
+        table.destroy()
+    return results
+
+
+def measure_open(file_format, directory):
+    # Opens every table and reads the first screen of rows, as the app does
+    rss_before = current_rss()
+    start = time.perf_counter()
+    rows = 0
+    for name, schema in table_schemas.items():
+        if file_format == 'csv':
+            path = os.path.join(directory, f'{name}_data.csv')
+        else:
+            path = feather_path(directory, name)
+        if not os.path.exists(path):
+            continue
+        if file_format == 'csv':
+            table = read_csv(path, schema, indexes=table_indexes.get(name, ()))
+        else:
+            table = open_table(path, schema, table_indexes.get(name, ()))
+        table.rows(table.row_ids()[:50])
+        rows += len(table)
+    return {'format': file_format, 'rows': rows, 'seconds': time.perf_counter() - start,
+            'rss_mb': current_rss() / 2 ** 20, 'rss_delta_mb': (current_rss() - rss_before) / 2 ** 20}
+
+
+def bench_storage_open(csv_dir):
+    # Each format is opened in a fresh interpreter so the RSS figures are independent
+    results = []
+    with tempfile.TemporaryDirectory() as feather_dir:
+        convert_csv(csv_dir, feather_dir)
+        for file_format, directory in (('csv', csv_dir), ('feather', feather_dir)):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), 'open', file_format, directory],
+                                    capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+
+class MessageLog:
+    # Takes the place of the app's message boxes, which would wait for a click
+
+    def __init__(self):
+        self.messages = []
+
+    def showinfo(self, title, message, **kw):
+        self.messages.append(('info', message))
+
+    def showwarning(self, title, message, **kw):
+        self.messages.append(('warning', message))
+
+    def showerror(self, title, message, **kw):
+        self.messages.append(('error', message))
+
+    def run(self, root, function, timeout=600):
+        # Calls function, then runs the event loop until the app reports the
+        # end of the background job it started
+        deadline = time.perf_counter() + timeout
+        count = len(self.messages)
+        function()
+        while len(self.messages) == count:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("timed out waiting for the app")
+            root.update()
+            time.sleep(0.001)
+        kind, message = self.messages[-1]
+        if kind == 'error':
+            raise RuntimeError(message)
+        return message
+
+
+def measure(results, name, function, repeat=1):
+    # Mean seconds of function() and the peak RSS while it ran
+    reset_peak_rss()
+    rss_before = current_rss()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    seconds = (time.perf_counter() - start) / repeat
+    peak = peak_rss()
+    results[name] = {'seconds': seconds, 'peak_mb': peak / 2 ** 20, 'delta_mb': (peak - rss_before) / 2 ** 20}
+    return results[name]
+
+
+def bench_paths(data_dir, adds=200, filters=50, headless=False, seed=0):
+    # The app's own load, save, table refresh and entry paths on a copy of the
+    # dataset, measured through BiobankApp as a user would trigger them
+    root, headless = open_tk(headless)
+    import BiobankApp as app_module
+    log = app_module.messagebox = MessageLog()
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in table_schemas:
+            shutil.copy(os.path.join(data_dir, f'{name}_data.csv'), work_dir)
+        os.chdir(work_dir)
+        try:
+            app = app_module.BiobankApp(root)
+            # Sets up the tables, then the entries are made on the Condition Occurrence tab
+            root.update()
+            app.show_tab('condition_occurrence')
+            measure(results, 'load_from_csv', lambda: log.run(root, app.load_from_csv))
+            rows = sum(len(app.table_data(name)) for name in table_schemas)
+
+            conditions = app.condition_data
+            measure(results, 'update_table', lambda: app.update_table(app.condition_table, conditions), repeat=5)
+            rng = np.random.default_rng(seed)
+            persons = app.omop_data.values('person_id').dropna().to_numpy()
+            picks = iter(rng.choice(persons, filters).tolist())
+            measure(results, 'update_table filter_person_id',
+                    lambda: app.update_table(app.condition_table, conditions, filter_person_id=str(next(picks))),
+                    repeat=filters)
+
+            first_id = int(conditions.values('condition_occurrence_id').max()) + 1
+            entries = iter(range(first_id, first_id + adds))
+            latencies = []
+
+            def add_condition():
+                fields = {'condition_occurrence_id': next(entries), 'person_id': int(rng.choice(persons)),
+                          'condition_concept_id': 201826, 'condition_start_date': '2024-01-31',
+                          'condition_type_concept_id': 32817}
+                for field, value in fields.items():
+                    app.condition_entries[field].delete(0, 'end')
+                    app.condition_entries[field].insert(0, value)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    app.add_entry('condition_occurrence')
+                latencies.append(time.perf_counter() - start)
+                if log.messages[-1][0] == 'error':
+                    raise RuntimeError(log.messages[-1][1])
+
+            measure(results, 'add_condition_entry', add_condition, repeat=adds)
+            results['add_condition_entry']['seconds'] = float(np.mean(latencies))
+            results['add_condition_entry']['p95_seconds'] = float(np.percentile(latencies, 95))
+
+            measure(results, 'save_to_csv appended rows', lambda: log.run(root, app.save_to_csv))
+            # A single edit makes every table rewrite its file
+            for name in table_schemas:
+                data = app.table_data(name)
+                if len(data):
+                    row_id = int(data.row_ids()[0])
+                    data.update(row_id, data.get(row_id))
+            measure(results, 'save_to_csv rewrite', lambda: log.run(root, app.save_to_csv))
+            app.tasks.shutdown()
+        finally:
+            os.chdir(cwd)
+    root.destroy()
+    return {'rows': rows, 'headless': headless, 'results': results}
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    # Lines for the measurements that got slower or hungrier than the baseline
+    regressions = []
+    if baseline.get('rows') != report['rows']:
+        print(f"Baseline has {baseline.get('rows')} rows, this run {report['rows']}: not comparable",
+              file=sys.stderr)
+        return regressions
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for key, unit, minimum in (('seconds', 's', MIN_SECONDS), ('peak_mb', 'MB', MIN_MB)):
+            if result[key] > before[key] * (1 + tolerance) and result[key] - before[key] > minimum:
+                regressions.append(f"{name}: {key} {before[key]:.3f}{unit} -> {result[key]:.3f}{unit} "
+                                   f"(+{(result[key] / before[key] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def run_paths(args):
+    if args.data_dir:
+        data_dir = args.data_dir
+    else:
+        data_dir = tempfile.mkdtemp()
+        write_dataset(data_dir, args.rows, args.seed)
+    try:
+        report = bench_paths(data_dir, args.adds, args.filters, args.headless, args.seed)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    print(f"{report['rows']} rows{' (headless Tk)' if report['headless'] else ''}")
+    print(f"{'measurement':>30} {'seconds':>10} {'peak MB':>9} {'delta MB':>9}")
+    for name, result in report['results'].items():
+        print(f"{name:>30} {result['seconds']:>10.4f} {result['peak_mb']:>9.1f} {result['delta_mb']:>9.1f}")
+    p95 = report['results']['add_condition_entry']['p95_seconds']
+    print(f"{'add_condition_entry p95':>30} {p95:>10.4f}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(report, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Biobank Data Manager benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="latency of adding rows to a large table")
+    add.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                     help="number of existing rows before the adds")
+    add.add_argument('--adds', type=int, default=1000, help="number of rows added per run")
+
+    storage = commands.add_parser('storage', help="open time and RSS of CSV against Feather")
+    storage.add_argument('--csv-dir', default='.', help="directory holding the <table>_data.csv exports")
+
+    paths = commands.add_parser('paths', help="load, save, table refresh and entry latency of the app")
+    paths.add_argument('--rows', type=int, default=100000, help="rows of the synthetic dataset")
+    paths.add_argument('--seed', type=int, default=0, help="seed of the synthetic dataset")
+    paths.add_argument('--data-dir', help="use these <table>_data.csv files instead of a synthetic dataset")
+    paths.add_argument('--adds', type=int, default=200, help="entries added through the form")
+    paths.add_argument('--filters', type=int, default=50, help="person filters applied to the table")
+    paths.add_argument('--headless', action='store_true', help="use the headless Tk stand-in even with a display")
+    paths.add_argument('--baseline', default='benchmark_baseline.json', help="results to compare against")
+    paths.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    paths.add_argument('--tolerance', type=float, default=TOLERANCE,
+                       help="allowed slowdown or memory growth as a fraction of the baseline")
+
+    open_format = commands.add_parser('open', help=argparse.SUPPRESS)
+    open_format.add_argument('format', choices=['csv', 'feather'])
+    open_format.add_argument('directory')
+
+    args = parser.parse_args()
+    if args.command == 'paths':
+        return run_paths(args)
+    if args.command == 'add':
+        root, _ = open_tk()
+        print(f"{'existing rows':>14} {'us per add':>12}")
+        for n, seconds in bench_incremental_add(root, args.rows, args.adds):
+            print(f"{n:>14} {seconds * 1e6:>12.1f}")
+        root.destroy()
+    elif args.command == 'storage':
+        results = bench_storage_open(args.csv_dir)
+        print(f"{'format':>8} {'rows':>10} {'open s':>8} {'RSS MB':>8} {'RSS delta MB':>13}")
+        for result in results:
+            print(f"{result['format']:>8} {result['rows']:>10} {result['seconds']:>8.3f} "
+                  f"{result['rss_mb']:>8.1f} {result['rss_delta_mb']:>13.1f}")
+    else:
+        print(json.dumps(measure_open(args.format, args.directory)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
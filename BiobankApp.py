@@ -1,335 +1,819 @@
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-import pandas as pd
-from DataModel import miabis_schema, sprec_schema, omop_person_schema, condition_occurrence_schema, procedure_occurrence_schema
+from tkinter import ttk, messagebox, filedialog
+import Profiling
+from Profiling import span
+from Tasks import TaskRunner
+from VirtualTable import VirtualTreeview
+from DataModel import table_schemas, table_indexes, table_form
+
+# NumPy, pandas and the modules built on them (ColumnStore, Query, CsvLoader,
+# FeatherStore, SqliteStore, Validation, Aggregates) are imported by the
+# methods using them, so the window opens before they are loaded.
+
+# Table name -> prefix of the BiobankApp attributes holding its tab, form
+# entries, data and Treeview; tables added to DataModel use their own name
+TABLE_ATTRIBUTES = dict({name: name for name in table_schemas}, omop_person='omop',
+                        condition_occurrence='condition', procedure_occurrence='procedure')
+
+# Pause in typing before a table's query bar filter is run
+SEARCH_DELAY_MS = 150
+# Rows left out of a load and dangling references are listed here
+LOAD_REPORT = 'load_errors.csv'
+# The diagnostics window refreshes this often while it is open
+DIAGNOSTICS_MS = 1000
+DIAGNOSTICS_COLUMNS = ['operation', 'count', 'total s', 'mean ms', 'max ms', 'rows', 'memory MB']
 
 def clear_form(entries):
     for field in entries.values():
         field.delete(0, tk.END)
 
 class BiobankApp:
-    def __init__(self, root):
+    def __init__(self, root, storage='csv', database='biobank.db'):
         self.root = root
+        self.storage = storage
+        self.database = database
+        # Opened with the first table, see new_data
+        self.connection = None
         self.root.title("Biobank Data Entry and Exploration")
+        # Loads, saves, exports and filters run on its workers
+        self.tasks = TaskRunner(root)
+        self.current_load = None
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
-        # Create tabs
+        # One tab per table, its form and table are built when first shown
         self.tab_control = ttk.Notebook(root)
-        self.miabis_tab = ttk.Frame(self.tab_control)
-        self.sprec_tab = ttk.Frame(self.tab_control)
-        self.omop_tab = ttk.Frame(self.tab_control)
-        self.condition_tab = ttk.Frame(self.tab_control)
-        self.procedure_tab = ttk.Frame(self.tab_control)
-        self.tab_control.add(self.miabis_tab, text='MIABIS')
-        self.tab_control.add(self.sprec_tab, text='SPREC')
-        self.tab_control.add(self.omop_tab, text='OMOP Person')
-        self.tab_control.add(self.condition_tab, text='Condition Occurrence')
-        self.tab_control.add(self.procedure_tab, text='Procedure Occurrence')
+        for name, prefix in TABLE_ATTRIBUTES.items():
+            tab = ttk.Frame(self.tab_control)
+            setattr(self, prefix + '_tab', tab)
+            self.tab_control.add(tab, text=table_form(name)['title'])
+        self.summary_tab = ttk.Frame(self.tab_control)
+        self.tab_control.add(self.summary_tab, text='Summary')
         self.tab_control.pack(expand=1, fill='both')
-
-        # Initialize data storage
-        self.miabis_data = []
-        self.sprec_data = []
-        self.omop_data = []
-        self.condition_data = []
-        self.procedure_data = []
-
-        # Create form fields for MIABIS
-        self.create_miabis_form()
-        # Create form fields for SPREC
-        self.create_sprec_form()
-        # Create form fields for OMOP Person
-        self.create_omop_form()
-        # Create form fields for Condition Occurrence
-        self.create_condition_form()
-        # Create form fields for Procedure Occurrence
-        self.create_procedure_form()
+        self.tab_control.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+
+        self.table_filters = {}
+        self.table_queries = {}
+        self.query_bars = {}
+        self.pending_searches = {}
+        self.filter_tasks = {}
+        # Person filters of the tables not built yet, applied when they are
+        self.pending_filters = {}
+        # Cohort counts over all tables, set up with the Summary tab
+        self.aggregator = None
+        self.summary_task = None
+        self.summary_stale = False
 
         # Add buttons
-        self.save_button = tk.Button(root, text="Save to CSV", command=self.save_to_csv)
+        if storage == 'feather':
+            self.save_button = tk.Button(root, text="Save to Feather", command=self.save_to_feather)
+            self.load_button = tk.Button(root, text="Open Feather", command=self.open_feather)
+        elif storage == 'sqlite':
+            self.save_button = tk.Button(root, text="Save to Database", command=self.save_to_database)
+            self.load_button = tk.Button(root, text="Import CSV", command=self.import_csv)
+        else:
+            self.save_button = tk.Button(root, text="Save to CSV", command=self.save_to_csv)
+            self.load_button = tk.Button(root, text="Load from CSV", command=self.load_from_csv)
+        self.cancel_button = tk.Button(root, text="Cancel Load", command=self.cancel_load, state=tk.DISABLED)
+        self.export_button = tk.Button(root, text="Export View", command=self.export_view)
+        self.diagnostics_button = tk.Button(root, text="Diagnostics", command=self.open_diagnostics)
+        self.diagnostics = None
         self.save_button.pack(side=tk.LEFT, padx=10, pady=10)
-        self.load_button = tk.Button(root, text="Load from CSV", command=self.load_from_csv)
         self.load_button.pack(side=tk.LEFT, padx=10, pady=10)
-
-    def create_table(self, parent, columns):
+        self.cancel_button.pack(side=tk.LEFT, padx=10, pady=10)
+        self.export_button.pack(side=tk.LEFT, padx=10, pady=10)
+        self.diagnostics_button.pack(side=tk.LEFT, padx=10, pady=10)
+        self.status_label = tk.Label(root, text="")
+        self.status_label.pack(side=tk.LEFT, padx=10, pady=10)
+        # The tables and the first tab are set up once the window is drawn
+        self.root.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        for name in TABLE_ATTRIBUTES:
+            self.table_data(name)
+        self.on_tab_changed()
+
+    def new_data(self, name):
+        if self.storage == 'sqlite':
+            from SqliteStore import SqliteTable, open_database
+            if self.connection is None:
+                self.connection = open_database(self.database)
+            return SqliteTable(self.connection, name, table_schemas[name])
+        from ColumnStore import ColumnTable
+        return ColumnTable(table_schemas[name], table_indexes.get(name, ()))
+
+    def create_table(self, parent, columns, row):
         container = ttk.Frame(parent)
-        container.grid(row=0, column=0, columnspan=parent.grid_size()[0], sticky='nsew')
+        container.grid(row=row, column=0, columnspan=parent.grid_size()[0], sticky='nsew')
 
-        table = ttk.Treeview(container, columns=list(columns), show='headings')
+        # Only the rows in view are materialized, see VirtualTreeview
+        table = VirtualTreeview(container, columns=list(columns), show='headings')
         for col in columns:
-            table.heading(col, text=col)
+            table.heading(col, text=col, command=lambda c=col: self.sort_table(table, c))
             table.column(col, width=100)
-        table.grid(row=0, column=0, sticky='nsew')
+        table.grid(row=1, column=0, sticky='nsew')
+
+        self.create_query_bar(container, table, columns).grid(row=0, column=0, columnspan=2, sticky='ew')
+
+        scrollbar_y = ttk.Scrollbar(container, orient='vertical', command=table.yview)
+        table.configure(yscrollcommand=scrollbar_y.set)
+        scrollbar_y.grid(row=1, column=1, sticky='ns')
 
         scrollbar_x = ttk.Scrollbar(container, orient='horizontal', command=table.xview)
         table.configure(xscrollcommand=scrollbar_x.set)
-        scrollbar_x.grid(row=1, column=0, sticky='ew')
+        scrollbar_x.grid(row=2, column=0, sticky='ew')
 
-        container.grid_rowconfigure(0, weight=1)
+        container.grid_rowconfigure(1, weight=1)
         container.grid_columnconfigure(0, weight=1)
 
-        # Bind the <Configure> event to update the total width
-        table.bind('<Configure>', lambda e: self.update_total_width(container, table, scrollbar_x))
+        # Bind the <Configure> event to update the total width, once per frame however many events arrive
+        table.bind('<Configure>', lambda e: self.tasks.coalesce(
+            (table, 'width'), self.update_total_width, container, table, scrollbar_x), add='+')
 
         return table
 
-    def update_total_width(self, container, table, scrollbar_x):
-        total_width = sum(table.column(col, width=None) for col in table['columns'])
-        container.configure(width=total_width + scrollbar_x.winfo_width())
-        table.configure(xscrollcommand=scrollbar_x.set)
-        # Reload the table to ensure the horizontal scrollbar works
-        table.update_idletasks()
-
-    def add_miabis_entry(self):
-        entry = {field: self.miabis_entries[field].get() for field in miabis_schema.keys()}
-        print("MIABIS Entry:", entry)  # Debug print
-        self.miabis_data.append(entry)
-        self.update_table(self.miabis_table, self.miabis_data)
-        clear_form(self.miabis_entries)
-        messagebox.showinfo("Info", "MIABIS entry added")
-
-    def add_sprec_entry(self):
-        entry = {field: self.sprec_entries[field].get() for field in sprec_schema.keys()}
-        entry["person_id"] = self.person_id_entry.get()
-        print("SPREC Entry:", entry)  # Debug print
-        self.sprec_data.append(entry)
-        self.update_table(self.sprec_table, self.sprec_data)
-        clear_form(self.sprec_entries)
-        messagebox.showinfo("Info", "SPREC entry added")
-
-    def add_omop_entry(self):
-        entry = {field: self.omop_entries[field].get() for field in omop_person_schema.keys()}
-        entry["person_id"] = self.omop_person_id_entry.get()
-        print("OMOP Entry:", entry)  # Debug print
-        self.omop_data.append(entry)
-        self.update_table(self.omop_table, self.omop_data)
-        clear_form(self.omop_entries)
-        messagebox.showinfo("Info", "OMOP Person entry added")
-
-    def add_condition_entry(self):
-        entry = {field: self.condition_entries[field].get() for field in condition_occurrence_schema.keys()}
-        entry["person_id"] = self.condition_person_id_entry.get()
-        print("Condition Entry:", entry)  # Debug print
-        self.condition_data.append(entry)
-        self.update_table(self.condition_table, self.condition_data, filter_person_id=entry["person_id"])
-        clear_form(self.condition_entries)
-        messagebox.showinfo("Info", "Condition entry added")
-
-    def add_procedure_entry(self):
-        entry = {field: self.procedure_entries[field].get() for field in procedure_occurrence_schema.keys()}
-        entry["person_id"] = self.procedure_person_id_entry.get()
-        print("Procedure Entry:", entry)  # Debug print
-        self.procedure_data.append(entry)
-        self.update_table(self.procedure_table, self.procedure_data, filter_person_id=entry["person_id"])
-        clear_form(self.procedure_entries)
-        messagebox.showinfo("Info", "Procedure entry added")
+    def create_query_bar(self, parent, table, columns):
+        # Column, operator and value of a live filter, re-run as the operator types
+        from Query import OPERATORS
+        bar = ttk.Frame(parent)
+        column = ttk.Combobox(bar, values=list(columns), state='readonly', width=24)
+        column.current(0)
+        column.pack(side=tk.LEFT, padx=2)
+        operator = ttk.Combobox(bar, values=OPERATORS, state='readonly', width=10)
+        operator.current(0)
+        operator.pack(side=tk.LEFT, padx=2)
+        value = tk.Entry(bar)
+        value.pack(side=tk.LEFT, padx=2, fill=tk.X, expand=True)
+        status = tk.Label(bar, text="")
+        bar.fields = (column, operator, value, status)
+
+        search = lambda e=None: self.schedule_search(table)
+        value.bind('<KeyRelease>', search)
+        column.bind('<<ComboboxSelected>>', search)
+        operator.bind('<<ComboboxSelected>>', search)
+        tk.Button(bar, text="Add filter", command=lambda: self.pin_search(table)).pack(side=tk.LEFT, padx=2)
+        tk.Button(bar, text="Clear", command=lambda: self.clear_query(table)).pack(side=tk.LEFT, padx=2)
+        status.pack(side=tk.LEFT, padx=2)
+        self.query_bars[table] = bar
+        return bar
 
+    def update_total_width(self, container, table, scrollbar_x):
+        with span('update_total_width', table=self.table_name(table)):
+            total_width = sum(table.column(col, width=None) for col in table['columns'])
+            container.configure(width=total_width + scrollbar_x.winfo_width())
+            table.configure(xscrollcommand=scrollbar_x.set)
+            # Reload the table to ensure the horizontal scrollbar works
+            table.update_idletasks()
+
+    def add_entry(self, name):
+        form = table_form(name)
+        entries = getattr(self, TABLE_ATTRIBUTES[name] + '_entries')
+        entry = {field: entries[field].get() for field in table_schemas[name]}
+        print(f"{form['label']} Entry:", entry)  # Debug print
+        problems = self.validate_entry(name, entry)
+        if problems:
+            messagebox.showerror("Error", f"Invalid {form['label']} entry:\n" + "\n".join(problems))
+            return
+        data = self.table_data(name)
+        try:
+            row_id = data.append(entry)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid {form['label']} entry: {e}")
+            return
+        filter_person_id = entry['person_id'] if form['per_person'] else None
+        self.append_to_table(self.built_table(name), data, row_id, filter_person_id=filter_person_id)
+        clear_form(entries)
+        messagebox.showinfo("Info", f"{form['label']} entry added")
+
+    def validate_entry(self, name, entry):
+        # Same checks as a loaded file, against the rows sharing the entry's
+        # keys only, so this stays cheap on large tables
+        import pandas as pd
+        from Validation import table_validator
+        validator = table_validator(name)
+        existing, parents = {}, {}
+        for column in validator.unique:
+            data = self.table_data(name)
+            existing[column] = data.values(column, data.find(column, entry.get(column)))
+        for column, (parent, parent_column) in validator.references.items():
+            data = self.table_data(parent)
+            parents[column] = data.values(parent_column, data.find(parent_column, entry.get(column)))
+        _, errors = validator.validate(pd.DataFrame([entry]), 1, existing, parents)
+        return [f"{error.column}: {error.message}" for error in errors.itertuples()]
+
+    def table_data(self, name):
+        # Created on first use
+        data = getattr(self, TABLE_ATTRIBUTES[name] + '_data', None)
+        if data is None:
+            data = self.new_data(name)
+            setattr(self, TABLE_ATTRIBUTES[name] + '_data', data)
+        return data
+
+    def set_data(self, name, data):
+        # A table not built yet shows the new data when it is
+        setattr(self, TABLE_ATTRIBUTES[name] + '_data', data)
+        self.pending_filters.pop(name, None)
+        table = self.built_table(name)
+        if table is not None:
+            self.update_table(table, data)
+
+    def built_table(self, name):
+        # The table's Treeview, None until its tab is first shown
+        return getattr(self, TABLE_ATTRIBUTES[name] + '_table', None)
+
+    def tab_name(self, tab):
+        return next((name for name, prefix in TABLE_ATTRIBUTES.items()
+                     if str(getattr(self, prefix + '_tab')) == str(tab)), None)
+
+    def table_name(self, table):
+        return next((name for name, prefix in TABLE_ATTRIBUTES.items()
+                     if getattr(self, prefix + '_table', None) is table), None)
+
+    def append_to_table(self, table, data, key, filter_person_id=None):
+        # Patch the new row in when the table already shows this filter in
+        # storage order, rebuild otherwise
+        query = self.table_query(table, data)
+        if self.table_filters.get(table, None) == filter_person_id and query.is_plain():
+            table.append_row(key, see=True)
+        elif query.is_plain():
+            # Only the person filter, served by the hash index
+            self.update_table(table, data, filter_person_id=filter_person_id)
+        else:
+            self.requery_table(table, filter_person_id)
+
+    def extend_table(self, table, data, row_ids):
+        filter_person_id = self.table_filters.get(table, None)
+        query = self.table_query(table, data)
+        if filter_person_id is None and query.is_plain():
+            table.extend_rows(row_ids)
+        elif query.is_plain():
+            self.update_table(table, data, filter_person_id=filter_person_id)
+        else:
+            self.requery_table(table, filter_person_id)
+
+    def requery_table(self, table, filter_person_id):
+        # Rows added to a filtered or sorted table. The query reruns on a
+        # worker; one still running sees the newer version when it ends and
+        # runs again, so a burst of adds or loaded chunks queues no more.
+        self.table_filters[table] = filter_person_id
+        if table not in self.filter_tasks:
+            self.refresh_table(table)
+
+    def table_query(self, table, data):
+        # A table reloaded with new data keeps its filters and sort order
+        from Query import TableQuery
+        query = self.table_queries.get(table)
+        if query is None or query.table is not data:
+            query = TableQuery(data) if query is None else \
+                TableQuery(data, query.conditions, query.sort, query.descending)
+            self.table_queries[table] = query
+        return query
 
     def update_table(self, table, data, filter_person_id=None):
-        for row in table.get_children():
-            table.delete(row)
-        for entry in data:
-            if filter_person_id is None or entry.get('person_id') == filter_person_id:
-                table.insert('', 'end', values=list(entry.values()))
-
-    def create_miabis_form(self):
-        self.miabis_entries = {}
-        fields = list(miabis_schema.keys())
-        num_fields = len(fields)
-
-        for i, field in enumerate(fields):
-            row = i // 2
-            col = (i % 2) * 2
-            tk.Label(self.miabis_tab, text=field).grid(row=row, column=col, padx=10, pady=5)
-            entry = tk.Entry(self.miabis_tab)
-            entry.grid(row=row, column=col + 1, padx=10, pady=5)
-            self.miabis_entries[field] = entry
-
-        self.add_miabis_button = tk.Button(self.miabis_tab, text="Add MIABIS Entry", command=self.add_miabis_entry)
-        self.add_miabis_button.grid(row=(num_fields // 2) + 1, column=0, columnspan=4, pady=10)
-
-        self.miabis_table = self.create_table(self.miabis_tab, miabis_schema.keys())
-        self.update_table(self.miabis_table, self.miabis_data)
-        self.miabis_table.grid(row=(num_fields // 2) + 2, column=0, columnspan=4, sticky='nsew')
-
-        # Configure grid to expand the table
-        self.miabis_tab.grid_rowconfigure((num_fields // 2) + 2, weight=1)
-        self.miabis_tab.grid_columnconfigure(0, weight=1)
-        self.miabis_tab.grid_columnconfigure(1, weight=1)
-        self.miabis_tab.grid_columnconfigure(2, weight=1)
-        self.miabis_tab.grid_columnconfigure(3, weight=1)
-
-    def create_sprec_form(self):
-        self.sprec_entries = {}
-        for i, field in enumerate(sprec_schema.keys()):
-            tk.Label(self.sprec_tab, text=field).grid(row=i, column=0, padx=10, pady=5)
-            entry = tk.Entry(self.sprec_tab)
-            entry.grid(row=i, column=1, padx=10, pady=5)
-            self.sprec_entries[field] = entry
-
-        # Add person_id field
-        tk.Label(self.sprec_tab, text="person_id").grid(row=len(sprec_schema), column=0, padx=10, pady=5)
-        self.person_id_entry = tk.Entry(self.sprec_tab)
-        self.person_id_entry.grid(row=len(sprec_schema), column=1, padx=10, pady=5)
-        self.sprec_entries["person_id"] = self.person_id_entry
-
-        # Button to open OMOP Person form
-        self.open_omop_button = tk.Button(self.sprec_tab, text="Open OMOP Person Form", command=self.open_omop_form)
-        self.open_omop_button.grid(row=len(sprec_schema) + 1, column=1, columnspan=1, pady=10)
-
-        self.add_sprec_button = tk.Button(self.sprec_tab, text="Add SPREC Entry", command=self.add_sprec_entry)
-        self.add_sprec_button.grid(row=len(sprec_schema) + 1, column=0, columnspan=1, pady=10)
-
-        self.sprec_table = self.create_table(self.sprec_tab, list(sprec_schema.keys()) + ['person_id'])
-        self.update_table(self.sprec_table, self.sprec_data)
-        # Configure grid to expand the table
-        self.sprec_tab.grid_rowconfigure(len(sprec_schema) + 3, weight=1)
-        self.sprec_tab.grid_columnconfigure(0, weight=1)
-        self.sprec_tab.grid_columnconfigure(1, weight=1)
-
-    def create_omop_form(self):
-        self.omop_entries = {}
-        fields = list(omop_person_schema.keys())
-        num_fields = len(fields)
-
-        for i, field in enumerate(fields):
-            row = i // 2
-            col = (i % 2) * 2
-            tk.Label(self.omop_tab, text=field).grid(row=row, column=col, padx=10, pady=5)
-            entry = tk.Entry(self.omop_tab)
-            entry.grid(row=row, column=col + 1, padx=10, pady=5)
-            self.omop_entries[field] = entry
-
-        # Add person_id field at the end
-        tk.Label(self.omop_tab, text="person_id").grid(row=(num_fields // 2) + 1, column=0, padx=10, pady=5)
-        self.omop_person_id_entry = tk.Entry(self.omop_tab)
-        self.omop_person_id_entry.grid(row=(num_fields // 2) + 1, column=1, padx=10, pady=5)
-        self.omop_entries["person_id"] = self.omop_person_id_entry
-
-        # Button to open Condition and Procedure forms
-        self.open_condition_button = tk.Button(self.omop_tab, text="Open Condition Form",
-                                               command=self.open_condition_form)
-        self.open_condition_button.grid(row=(num_fields // 2) + 2, column=0, columnspan=1, pady=10)
-        self.open_procedure_button = tk.Button(self.omop_tab, text="Open Procedure Form",
-                                               command=self.open_procedure_form)
-        self.open_procedure_button.grid(row=(num_fields // 2) + 2, column=1, columnspan=1, pady=10)
-
-        self.add_omop_button = tk.Button(self.omop_tab, text="Add OMOP Person Entry", command=self.add_omop_entry)
-        self.add_omop_button.grid(row=(num_fields // 2) + 3, column=0, columnspan=2, pady=10)
-
-        self.omop_table = self.create_table(self.omop_tab, omop_person_schema.keys())
-        self.update_table(self.omop_table, self.omop_data)
-        self.omop_table.grid(row=(num_fields // 2) + 4, column=0, columnspan=4, sticky='nsew')
-
-        # Configure grid to expand the table
-        self.omop_tab.grid_rowconfigure((num_fields // 2) + 4, weight=1)
-        self.omop_tab.grid_columnconfigure(0, weight=1)
-        self.omop_tab.grid_columnconfigure(1, weight=1)
-        self.omop_tab.grid_columnconfigure(2, weight=1)
-        self.omop_tab.grid_columnconfigure(3, weight=1)
-
-    def create_condition_form(self):
-        self.condition_entries = {}
-        row_index = 0
-        for field in condition_occurrence_schema.keys():
-            if field != "person_id":  # Skip person_id as it will be handled separately
-                tk.Label(self.condition_tab, text=field).grid(row=row_index, column=0, padx=10, pady=5)
-                entry = tk.Entry(self.condition_tab)
-                entry.grid(row=row_index, column=1, padx=10, pady=5)
-                self.condition_entries[field] = entry
-                row_index += 1
-
-        # Add person_id field at the end
-        tk.Label(self.condition_tab, text="person_id").grid(row=row_index, column=0, padx=10, pady=5)
-        self.condition_person_id_entry = tk.Entry(self.condition_tab)
-        self.condition_person_id_entry.grid(row=row_index, column=1, padx=10, pady=5)
-        self.condition_entries["person_id"] = self.condition_person_id_entry
-
-        self.add_condition_button = tk.Button(self.condition_tab, text="Add Condition Entry", command=self.add_condition_entry)
-        self.add_condition_button.grid(row=row_index + 1, column=0, columnspan=2, pady=10)
-
-        self.condition_table = self.create_table(self.condition_tab, list(condition_occurrence_schema.keys()) + ['person_id'])
-        self.update_table(self.condition_table, self.condition_data)
-
-        self.condition_tab.grid_rowconfigure(len(condition_occurrence_schema) + 1, weight=1)
-        self.condition_tab.grid_columnconfigure(0, weight=1)
-        self.condition_tab.grid_columnconfigure(1, weight=1)
-
-    def create_procedure_form(self):
-        self.procedure_entries = {}
-        row_index = 0
-        for field in procedure_occurrence_schema.keys():
-            if field != "person_id":  # Skip person_id as it will be handled separately
-                tk.Label(self.procedure_tab, text=field).grid(row=row_index, column=0, padx=10, pady=5)
-                entry = tk.Entry(self.procedure_tab)
-                entry.grid(row=row_index, column=1, padx=10, pady=5)
-                self.procedure_entries[field] = entry
-                row_index += 1
-
-        # Add person_id field at the end
-        tk.Label(self.procedure_tab, text="person_id").grid(row=row_index, column=0, padx=10, pady=5)
-        self.procedure_person_id_entry = tk.Entry(self.procedure_tab)
-        self.procedure_person_id_entry.grid(row=row_index, column=1, padx=10, pady=5)
-        self.procedure_entries["person_id"] = self.procedure_person_id_entry
-
-        self.add_procedure_button = tk.Button(self.procedure_tab, text="Add Procedure Entry", command=self.add_procedure_entry)
-        self.add_procedure_button.grid(row=row_index + 1, column=0, columnspan=2, pady=10)
-
-        self.procedure_table = self.create_table(self.procedure_tab, list(procedure_occurrence_schema.keys()) + ['person_id'])
-        self.update_table(self.procedure_table, self.procedure_data)
-        self.procedure_table.grid(row=row_index + 2, column=0, columnspan=2, sticky='nsew')
-
-        self.procedure_tab.grid_rowconfigure(len(procedure_occurrence_schema) + 1, weight=1)
-        self.procedure_tab.grid_columnconfigure(0, weight=1)
-        self.procedure_tab.grid_columnconfigure(1, weight=1)
-
-    def open_omop_form(self):
-        person_id = self.person_id_entry.get()
-        self.omop_person_id_entry.delete(0, tk.END)
-        self.omop_person_id_entry.insert(0, person_id)
-        self.tab_control.select(self.omop_tab)
-        self.update_table(self.condition_table, self.condition_data, filter_person_id=person_id)
-        self.update_table(self.procedure_table, self.procedure_data, filter_person_id=person_id)
-
-    def open_condition_form(self):
-        person_id = self.omop_person_id_entry.get()
-        self.condition_person_id_entry.delete(0, tk.END)
-        self.condition_person_id_entry.insert(0, person_id)
-        self.tab_control.select(self.condition_tab)
-        self.update_table(self.condition_table, self.condition_data, filter_person_id=person_id)
-
-    def open_procedure_form(self):
-        person_id = self.omop_person_id_entry.get()
-        self.procedure_person_id_entry.delete(0, tk.END)
-        self.procedure_person_id_entry.insert(0, person_id)
-        self.tab_control.select(self.procedure_tab)
-        self.update_table(self.procedure_table, self.procedure_data, filter_person_id=person_id)
+        from Query import Equals
+        self.table_filters[table] = filter_person_id
+        extra = [] if filter_person_id is None else [Equals('person_id', filter_person_id)]
+        query = self.table_query(table, data)
+        with span('update_table', table=self.table_name(table), person_filter=filter_person_id is not None) as timed:
+            table.set_source(query.run(extra), data.rows, ascending=query.sort is None)
+            timed.set(rows=table.row_count())
+
+    def refresh_table(self, table):
+        # Filters and sorts on a worker, a newer request supersedes a running
+        # one. SQLite tables are queried on a connection of the worker's own.
+        from Query import Equals
+        from SqliteStore import SqliteTable, reading
+        query = self.table_queries[table]
+        data = query.table
+        filter_person_id = self.table_filters.get(table)
+        extra = [] if filter_person_id is None else [Equals('person_id', filter_person_id)]
+        version = data.version
+        previous = self.filter_tasks.pop(table, None)
+        if previous is not None:
+            previous.cancel()
+        # From the request to the rows on screen, including the wait for a worker
+        timed = span('filter', table=self.table_name(table), conditions=len(query.active_conditions(extra)))
+
+        def show(row_ids):
+            if self.filter_tasks.get(table) is not task:
+                timed.end(superseded=True)
+                return
+            del self.filter_tasks[table]
+            if self.table_queries.get(table) is not query or data.version != version:
+                # The rows changed meanwhile
+                timed.end(superseded=True)
+                self.refresh_table(table)
+                return
+            table.set_source(row_ids, data.rows, ascending=query.sort is None)
+            self.show_query_status(table)
+            timed.end(rows=len(row_ids))
+
+        def fail(e):
+            timed.end(error=str(e))
+            if self.filter_tasks.pop(table, None) is task:
+                self.query_bars[table].fields[3].configure(text=f"Invalid filter: {e}")
+
+        def run(task):
+            if isinstance(data, SqliteTable):
+                with reading(self.database) as conn:
+                    return query.run(extra, conn)
+            return query.run(extra)
+
+        task = self.tasks.submit(run, on_result=show, on_error=fail)
+        self.filter_tasks[table] = task
+
+    def sort_table(self, table, column):
+        # Heading clicks cycle ascending, descending and storage order
+        query = self.table_queries[table]
+        if query.sort != column:
+            query.sort, query.descending = column, False
+        elif not query.descending:
+            query.descending = True
+        else:
+            query.sort = None
+        for col in table['columns']:
+            arrow = '' if col != query.sort else (' \u25bc' if query.descending else ' \u25b2')
+            table.heading(col, text=col + arrow)
+        self.refresh_table(table)
+
+    def schedule_search(self, table):
+        # Coalesces keystrokes, the query runs once typing pauses
+        pending = self.pending_searches.pop(table, None)
+        if pending is not None:
+            self.root.after_cancel(pending)
+        self.pending_searches[table] = self.root.after(SEARCH_DELAY_MS, self.run_search, table)
+
+    def run_search(self, table):
+        from Query import parse_condition
+        self.pending_searches.pop(table, None)
+        column, operator, value, status = self.query_bars[table].fields
+        query = self.table_queries[table]
+        try:
+            query.search = parse_condition(column.get(), operator.get(), value.get())
+        except ValueError as e:
+            status.configure(text=f"Invalid filter: {e}")
+            return
+        self.refresh_table(table)
+
+    def pin_search(self, table):
+        # Keeps the current condition and frees the bar for the next column
+        query = self.table_queries[table]
+        self.run_search(table)
+        if query.search is not None:
+            query.conditions.append(query.search)
+            query.search = None
+            self.query_bars[table].fields[2].delete(0, tk.END)
+            self.show_query_status(table)
+
+    def clear_query(self, table):
+        query = self.table_queries[table]
+        query.conditions, query.search = [], None
+        self.query_bars[table].fields[2].delete(0, tk.END)
+        self.refresh_table(table)
+
+    def show_query_status(self, table):
+        query = self.table_queries[table]
+        status = self.query_bars[table].fields[3]
+        if query.conditions or query.search is not None:
+            status.configure(text=f"{table.row_count()} rows; " + "; ".join(map(str, query.active_conditions())))
+        else:
+            status.configure(text="")
+
+    def build_tab(self, name):
+        # Labels and entries for the fields of the table's schema, two per
+        # field, `columns` pairs to a row; person_id comes last, on a row of
+        # its own, then the buttons and the table
+        if self.built_table(name) is not None:
+            return
+        with span('build_tab', table=name):
+            prefix = TABLE_ATTRIBUTES[name]
+            tab = getattr(self, prefix + '_tab')
+            form = table_form(name)
+            columns = form['columns']
+            entries = {}
+            fields = [field for field in table_schemas[name] if field != 'person_id']
+            for i, field in enumerate(fields):
+                row = i // columns
+                col = (i % columns) * 2
+                tk.Label(tab, text=field).grid(row=row, column=col, padx=10, pady=5)
+                entry = tk.Entry(tab)
+                entry.grid(row=row, column=col + 1, padx=10, pady=5)
+                entries[field] = entry
+            row = -(-len(fields) // columns)
+            if 'person_id' in table_schemas[name]:
+                tk.Label(tab, text="person_id").grid(row=row, column=0, padx=10, pady=5)
+                entries['person_id'] = tk.Entry(tab)
+                entries['person_id'].grid(row=row, column=1, padx=10, pady=5)
+                row += 1
+            setattr(self, prefix + '_entries', entries)
+
+            # Add, then a button carrying the person_id to each linked form
+            buttons = ttk.Frame(tab)
+            buttons.grid(row=row, column=0, columnspan=2 * columns, pady=10)
+            tk.Button(buttons, text=f"Add {form['label']} Entry",
+                      command=lambda: self.add_entry(name)).pack(side=tk.LEFT, padx=10)
+            for target in form['links']:
+                tk.Button(buttons, text=f"Open {table_form(target)['label']} Form",
+                          command=lambda target=target: self.open_form(name, target)).pack(side=tk.LEFT, padx=10)
+
+            data = self.table_data(name)
+            table = self.create_table(tab, data.columns, row + 1)
+            setattr(self, prefix + '_table', table)
+            self.update_table(table, data, filter_person_id=self.pending_filters.pop(name, None))
+
+            # Configure grid to expand the table
+            tab.grid_rowconfigure(row + 1, weight=1)
+            for col in range(2 * columns):
+                tab.grid_columnconfigure(col, weight=1)
+
+    def show_tab(self, name):
+        self.build_tab(name)
+        self.tab_control.select(getattr(self, TABLE_ATTRIBUTES[name] + '_tab'))
+
+    def create_summary_view(self):
+        from Aggregates import Aggregator
+        self.aggregator = Aggregator()
+        bar = ttk.Frame(self.summary_tab)
+        bar.grid(row=0, column=0, columnspan=2, sticky='ew')
+        self.summary_choice = ttk.Combobox(bar, values=self.aggregator.titles(), state='readonly', width=32)
+        self.summary_choice.current(0)
+        self.summary_choice.pack(side=tk.LEFT, padx=2)
+        self.summary_choice.bind('<<ComboboxSelected>>', lambda e: self.refresh_summary())
+        tk.Button(bar, text="Refresh", command=self.refresh_summary).pack(side=tk.LEFT, padx=2)
+        self.summary_status = tk.Label(bar, text="")
+        self.summary_status.pack(side=tk.LEFT, padx=2)
+
+        self.summary_table = VirtualTreeview(self.summary_tab, columns=[], show='headings')
+        self.summary_table.grid(row=1, column=0, sticky='nsew')
+        scrollbar_y = ttk.Scrollbar(self.summary_tab, orient='vertical', command=self.summary_table.yview)
+        self.summary_table.configure(yscrollcommand=scrollbar_y.set)
+        scrollbar_y.grid(row=1, column=1, sticky='ns')
+        self.summary_tab.grid_rowconfigure(1, weight=1)
+        self.summary_tab.grid_columnconfigure(0, weight=1)
+
+    def on_tab_changed(self, event=None):
+        # Tabs are built when first shown; the summary is brought up to date
+        # whenever its tab is
+        selected = self.tab_control.select()
+        if selected == str(self.summary_tab):
+            if self.aggregator is None:
+                self.create_summary_view()
+            self.refresh_summary()
+        elif self.tab_name(selected) is not None:
+            self.build_tab(self.tab_name(selected))
+
+    def refresh_summary(self):
+        # Only the rows added since the last refresh are aggregated again, on
+        # a worker. One refresh runs at a time, requests meanwhile are folded
+        # into one rerun.
+        from SqliteStore import reading
+        if self.summary_task is not None:
+            self.summary_stale = True
+            return
+        title = self.summary_choice.get()
+        tables = {name: self.table_data(name) for name in TABLE_ATTRIBUTES}
+        start = time.perf_counter()
+
+        def run(task):
+            if self.storage == 'sqlite':
+                # Grouped by SQLite on a connection of the worker's own
+                with reading(self.database) as conn:
+                    return self.aggregator.result(title, tables, conn)
+            return self.aggregator.result(title, tables)
+
+        def show(frame):
+            self.summary_task = None
+            if self.summary_stale:
+                self.summary_stale = False
+                self.refresh_summary()
+                return
+            self.show_summary(frame, start)
+
+        def fail(e):
+            self.summary_task = None
+            self.summary_stale = False
+            self.summary_status.configure(text=f"Failed: {e}")
+
+        self.summary_task = self.tasks.submit(run, on_result=show, on_error=fail)
+
+    def show_summary(self, frame, start):
+        table = self.summary_table
+        columns = list(frame.columns)
+        if list(table['columns']) != columns:
+            table.configure(columns=columns)
+            for col in columns:
+                table.heading(col, text=col)
+                table.column(col, width=140)
+        rows = frame.astype(object).where(frame.notna(), '')
+        table.set_source(range(len(rows)), lambda keys: rows.iloc[list(keys)].values.tolist())
+        self.summary_status.configure(text=f"{len(frame)} groups in {time.perf_counter() - start:.2f}s")
+
+    def open_form(self, source, target):
+        # Carries the person_id over and lists that person's rows in the
+        # target's table, or else in the tables the target links to
+        person_id = getattr(self, TABLE_ATTRIBUTES[source] + '_entries')['person_id'].get()
+        self.show_tab(target)
+        entry = getattr(self, TABLE_ATTRIBUTES[target] + '_entries')['person_id']
+        entry.delete(0, tk.END)
+        entry.insert(0, person_id)
+        for name in [target] + table_form(target)['links']:
+            if table_form(name)['per_person']:
+                self.show_person(name, person_id)
+
+    def show_person(self, name, person_id):
+        table = self.built_table(name)
+        if table is None:
+            self.pending_filters[name] = person_id
+        else:
+            self.update_table(table, self.table_data(name), filter_person_id=person_id)
 
     def save_to_csv(self):
+        # Only the changes are written: unchanged tables are skipped, tables
+        # with new rows only get them appended, the rest are rewritten
+        from CsvLoader import CsvSaver
+        if self.loading():
+            return
+        for name in TABLE_ATTRIBUTES:
+            data = self.table_data(name)
+            if data.partial and data.needs_rewrite():
+                messagebox.showerror("Error", f"{name} was only partially loaded and its file has to be "
+                                              "rewritten, load it completely before saving")
+                return
+        files = []
+        for name in TABLE_ATTRIBUTES:
+            data = self.table_data(name)
+            rewrite, row_ids = data.begin_save()
+            if rewrite or len(row_ids):
+                files.append((name, f'{name}_data.csv', (rewrite, data, row_ids)))
+        self.start_save(CsvSaver(files), "CSV")
+
+    def save_to_feather(self):
+        # Feather files cannot be appended to, changed tables are rewritten whole
+        from FeatherStore import FeatherSaver, feather_path
+        if self.loading():
+            return
+        files = []
+        for name in TABLE_ATTRIBUTES:
+            data = self.table_data(name)
+            rewrite, row_ids = data.begin_save()
+            if rewrite or len(row_ids):
+                # A table opened from the file still maps it, and a mapped
+                # file cannot be replaced on Windows
+                data.make_writable()
+                files.append((name, feather_path('.', name), (data, data.row_ids())))
+        self.start_save(FeatherSaver(files), "Feather")
+
+    def start_save(self, saver, file_format):
+        # The snapshots of the rows are taken and written on the workers
+        if not saver.files:
+            messagebox.showinfo("Info", "No changes to save")
+            return
+        # A load meanwhile would read the files being written
+        self.save_button.configure(state=tk.DISABLED)
+        self.load_button.configure(state=tk.DISABLED)
+        errors = []
+        timed = span('save', format=file_format, files=len(saver.files))
+        self.tasks.watch(saver.start(self.tasks.executor),
+                         lambda kind, name, payload: self.on_save_event(file_format, errors, timed, kind, name, payload))
+
+    def on_save_event(self, file_format, errors, timed, kind, name, payload):
+        if kind == 'error':
+            self.table_data(name).abort_save()
+            errors.append(f"{name}: {payload}")
+        elif kind == 'finished':
+            timed.end(errors=len(errors))
+            self.save_button.configure(state=tk.NORMAL)
+            self.load_button.configure(state=tk.NORMAL)
+            if errors:
+                messagebox.showerror("Error", "Failed to save data:\n" + "\n".join(errors))
+            else:
+                messagebox.showinfo("Info", f"Data saved to {file_format} files")
+
+    def load_from_csv(self):
+        # All files are streamed concurrently and shown chunk by chunk
+        from CsvLoader import CsvLoader
+        files = []
+        for name in TABLE_ATTRIBUTES:
+            self.set_data(name, self.new_data(name))
+            files.append((name, f'{name}_data.csv', table_schemas[name]))
+        self.start_load(CsvLoader(files))
+
+    def loading(self):
+        # Tables being loaded are not saved: their files would be rewritten
+        # from the rows read so far
+        if self.current_load is not None:
+            messagebox.showerror("Error", "Wait for the load to finish, or cancel it, before saving")
+        return self.current_load is not None
+
+    def start_load(self, loader):
+        # Saving or exporting the tables being filled is held off until the end
+        for button in (self.load_button, self.save_button, self.export_button):
+            button.configure(state=tk.DISABLED)
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.current_load = loader
+        self.load_span = span('load', storage=self.storage, files=len(loader.files))
+        errors, problems = [], []
+        self.tasks.watch(loader.start(self.tasks.executor),
+                         lambda kind, name, payload: self.on_load_event(errors, problems, kind, name, payload))
+
+    def cancel_load(self):
+        # Workers stop after their current chunk, the rows loaded so far stay
+        if self.current_load is not None:
+            self.current_load.cancel()
+            self.status_label.configure(text="Cancelling...")
+
+    def on_load_event(self, errors, problems, kind, name, payload):
+        from ColumnStore import ColumnTable
+        if kind in ('chunk', 'rows'):
+            data = self.table_data(name)
+            if kind == 'chunk':
+                row_ids = data.extend_prepared(payload, saved=True)
+            else:
+                # Already stored by the importer's own connection
+                row_ids = payload
+                data.notify_inserted(row_ids)
+            if self.built_table(name) is not None:
+                self.extend_table(self.built_table(name), data, row_ids)
+            if not self.current_load.cancelled.is_set():
+                self.status_label.configure(text=f"Loading {name}: {len(data)} rows")
+        elif kind == 'header':
+            self.table_data(name).file_columns = payload
+        elif kind in ('done', 'cancelled') and isinstance(self.table_data(name), ColumnTable):
+            self.table_data(name).mark_loaded(partial=kind == 'cancelled')
+        elif kind == 'invalid':
+            problems.append(payload.assign(table=name))
+        elif kind == 'error':
+            errors.append(f"{name}: {payload}")
+            if isinstance(self.table_data(name), ColumnTable) and not isinstance(payload, FileNotFoundError):
+                # Stopped partway through the file: only its first rows are
+                # loaded, as when cancelled. Without a file the table is new.
+                self.table_data(name).mark_loaded(partial=True)
+        elif kind == 'finished':
+            cancelled = self.current_load.cancelled.is_set()
+            self.load_span.end(rows=sum(len(self.table_data(name)) for name in TABLE_ATTRIBUTES),
+                               cancelled=cancelled, errors=len(errors))
+            self.current_load = None
+            self.cancel_button.configure(state=tk.DISABLED)
+            for button in (self.load_button, self.save_button, self.export_button):
+                button.configure(state=tk.NORMAL)
+            self.status_label.configure(text="Load cancelled" if cancelled else "")
+            self.finish_load(errors, problems, "CSV")
+
+    def finish_load(self, errors, problems, file_format):
+        # Dangling references are looked for on a worker; SQLite enforces them itself
+        if self.storage == 'sqlite':
+            self.show_load_result(errors, problems, file_format)
+            return
+        from Validation import check_references
+        # The rows left out are not in the tables, a save rewriting their
+        # files drops them from those too
+        skipped = sum(len(report.drop_duplicates(['table', 'row'])) for report in problems)
+        tables = {name: self.table_data(name) for name in TABLE_ATTRIBUTES}
+        self.tasks.submit(lambda task: check_references(tables),
+                          on_result=lambda report: self.show_load_result(errors, problems + [report], file_format,
+                                                                         skipped),
+                          on_error=lambda e: self.show_load_result(errors + [f"references: {e}"], problems,
+                                                                   file_format, skipped))
+
+    def show_load_result(self, errors, problems, file_format, skipped=0):
+        import pandas as pd
+        from Validation import error_lines
+        problems = [report for report in problems if len(report)]
+        if problems:
+            report = pd.concat(problems, ignore_index=True)[['table', 'row', 'column', 'value', 'message']]
+            report.to_csv(LOAD_REPORT, sep=';', index=False)
+        if errors:
+            messagebox.showerror("Error", "Failed to load data:\n" + "\n".join(errors))
+        elif problems:
+            dropped = f"{skipped} rows were skipped and are removed from their files when those tables are " \
+                      f"next rewritten by a save.\n" if skipped else ""
+            messagebox.showwarning("Warning", f"Data loaded from {file_format} files with {len(report)} problems, "
+                                   f"listed in {LOAD_REPORT}:\n" + dropped + "\n".join(error_lines(report)))
+        else:
+            messagebox.showinfo("Info", f"Data loaded from {file_format} files")
+
+    def save_to_database(self):
+        # Every change is already committed as its own transaction, this
+        # only folds the write-ahead log back into the database file
         try:
-            pd.DataFrame(self.miabis_data).to_csv('miabis_data.csv', sep=';', index=False)
-            pd.DataFrame(self.sprec_data).to_csv('sprec_data.csv', sep=';', index=False)
-            pd.DataFrame(self.omop_data).to_csv('omop_person_data.csv', sep=';', index=False)
-            pd.DataFrame(self.condition_data).to_csv('condition_occurrence_data.csv', sep=';', index=False)
-            pd.DataFrame(self.procedure_data).to_csv('procedure_occurrence_data.csv', sep=';', index=False)
-            messagebox.showinfo("Info", "Data saved to CSV files")
+            self.connection.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            messagebox.showinfo("Info", "Data saved to database")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save data: {e}")
 
-    def load_from_csv(self):
+    def import_csv(self):
+        # Appends the CSV files to the database tables, referenced tables first
+        from SqliteStore import SqliteImporter
+        files = [(name, f'{name}_data.csv', table_schemas[name]) for name in TABLE_ATTRIBUTES]
+        self.start_load(SqliteImporter(self.database, files))
+
+    def open_feather(self):
+        # Memory-mapped, so only the pages shown in the tables are read from disk
+        from FeatherStore import feather_path, open_table
+        errors = []
+        with span('load', storage=self.storage, files=len(TABLE_ATTRIBUTES)) as timed:
+            for name in TABLE_ATTRIBUTES:
+                try:
+                    data = open_table(feather_path('.', name), table_schemas[name], table_indexes.get(name, ()))
+                except Exception as e:
+                    errors.append(f"{name}: {e}")
+                    continue
+                self.set_data(name, data)
+            timed.set(rows=sum(len(self.table_data(name)) for name in TABLE_ATTRIBUTES), errors=len(errors))
+        self.finish_load(errors, [], "Feather")
+
+    def export_view(self):
+        # Writes the rows of the current tab as filtered and sorted on screen
+        name = self.tab_name(self.tab_control.select())
+        if name is None:
+            messagebox.showinfo("Info", "Select a table tab to export")
+            return
+        table = self.built_table(name)
+        path = filedialog.asksaveasfilename(defaultextension='.csv', initialfile=f'{name}_export.csv',
+                                            filetypes=[("CSV files", "*.csv")])
+        if not path:
+            return
+        row_ids = table.row_keys()
+        self.status_label.configure(text=f"Exporting {len(row_ids)} {name} rows...")
+        self.tasks.submit(self.export_rows, name, row_ids, path,
+                          on_result=lambda rows: self.status_label.configure(text=f"Exported {rows} rows to {path}"),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to export data: {e}"))
+
+    def export_rows(self, task, name, row_ids, path):
+        from CsvLoader import write_csv
+        from SqliteStore import SqliteTable, reading
+        if self.storage == 'sqlite':
+            # Connections stay on the thread that opened them
+            with reading(self.database) as conn:
+                frame = SqliteTable(conn, name, table_schemas[name]).to_dataframe(row_ids)
+        else:
+            frame = self.table_data(name).to_dataframe(row_ids)
+        task.check_cancelled()
+        write_csv(frame, path)
+        return len(frame)
+
+    def open_diagnostics(self):
+        # Timings of the instrumented operations, see Profiling.py
+        if self.diagnostics is not None:
+            self.diagnostics.lift()
+            return
+        window = self.diagnostics = tk.Toplevel(self.root)
+        window.title("Diagnostics")
+        window.protocol("WM_DELETE_WINDOW", self.close_diagnostics)
+        bar = ttk.Frame(window)
+        bar.pack(fill=tk.X)
+        self.record_button = tk.Button(bar, command=self.toggle_recording)
+        self.record_button.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Button(bar, text="Clear", command=self.clear_diagnostics).pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Button(bar, text="Save Trace", command=self.save_trace).pack(side=tk.LEFT, padx=5, pady=5)
+        self.diagnostics_table = ttk.Treeview(window, columns=DIAGNOSTICS_COLUMNS, show='headings')
+        for col in DIAGNOSTICS_COLUMNS:
+            self.diagnostics_table.heading(col, text=col)
+            self.diagnostics_table.column(col, width=160 if col == 'operation' else 90)
+        self.diagnostics_table.pack(expand=1, fill='both')
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        table = self.diagnostics_table
+        table.delete(*table.get_children())
+        for total in Profiling.RECORDER.summary():
+            table.insert('', 'end', values=[total['name'], total['count'], f"{total['seconds']:.3f}",
+                                            f"{total['mean_seconds'] * 1000:.2f}", f"{total['max_seconds'] * 1000:.2f}",
+                                            total['rows'], f"{total['memory_delta'] / 2 ** 20:.1f}"])
+        self.record_button.configure(text="Stop Recording" if Profiling.enabled() else "Start Recording")
+        self.diagnostics_after = self.root.after(DIAGNOSTICS_MS, self.refresh_diagnostics)
+
+    def close_diagnostics(self):
+        self.root.after_cancel(self.diagnostics_after)
+        self.diagnostics.destroy()
+        self.diagnostics = None
+
+    def toggle_recording(self):
+        if Profiling.enabled():
+            Profiling.disable()
+        else:
+            Profiling.enable()
+        self.root.after_cancel(self.diagnostics_after)
+        self.refresh_diagnostics()
+
+    def clear_diagnostics(self):
+        Profiling.RECORDER.clear()
+        self.root.after_cancel(self.diagnostics_after)
+        self.refresh_diagnostics()
+
+    def save_trace(self):
+        path = filedialog.asksaveasfilename(defaultextension='.json', initialfile='biobank_trace.json',
+                                            filetypes=[("Trace files", "*.json")])
+        if not path:
+            return
         try:
-            self.miabis_data = pd.read_csv('miabis_data.csv', sep=';').to_dict(orient='records')
-            self.sprec_data = pd.read_csv('sprec_data.csv', sep=';').to_dict(orient='records')
-            self.omop_data = pd.read_csv('omop_person_data.csv', sep=';').to_dict(orient='records')
-            self.condition_data = pd.read_csv('condition_occurrence_data.csv', sep=';').to_dict(orient='records')
-            self.procedure_data = pd.read_csv('procedure_occurrence_data.csv', sep=';').to_dict(orient='records')
-            self.update_table(self.miabis_table, self.miabis_data)
-            self.update_table(self.sprec_table, self.sprec_data)
-            self.update_table(self.omop_table, self.omop_data)
-            self.update_table(self.condition_table, self.condition_data)
-            self.update_table(self.procedure_table, self.procedure_data)
-            messagebox.showinfo("Info", "Data loaded from CSV files")
+            Profiling.RECORDER.dump(path)
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to load data: {e}")
+            messagebox.showerror("Error", f"Failed to save trace: {e}")
+
+    def close(self):
+        self.tasks.shutdown()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
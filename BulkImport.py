@@ -0,0 +1,207 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from ColumnStore import ColumnTable, parse_ints
+from CsvLoader import CHUNK_ROWS, csv_header, iter_csv_chunks, write_csv, append_csv, recover_csv
+from DataModel import table_schemas
+from SqliteStore import open_database, table_order, SqliteTable
+from Validation import KeySet, table_validator
+
+SEPARATORS = [';', '\t', ',', '|']
+
+
+def detect_separator(path):
+    # LIMS and EHR extracts differ, the header line decides
+    with open(path, newline='') as f:
+        header = f.readline()
+    return max(SEPARATORS, key=header.count)
+
+
+def stored_values(storage, directory, conn, name, column):
+    # Values of one column already written to the storage, for the key checks
+    schema = table_schemas[name]
+    if storage == 'sqlite':
+        return SqliteTable(conn, name, schema).values(column)
+    if storage == 'feather':
+        from FeatherStore import feather_path, open_table
+        path = feather_path(directory, name)
+        return open_table(path, schema).values(column) if os.path.exists(path) else []
+    path = os.path.join(directory, f'{name}_data.csv')
+    if not os.path.exists(path):
+        return []
+    recover_csv(path)
+    if column not in csv_header(path):
+        return []
+    values = pd.read_csv(path, sep=';', usecols=[column], dtype=str)[column]
+    return parse_ints(values) if schema[column] == 'int' else values
+
+
+class CsvTarget:
+    # Appends the accepted rows of each chunk to <table>_data.csv through the
+    # journal. A file without the table's header, e.g. with its columns in
+    # another order or an empty one, is rewritten with it on the first write.
+
+    def __init__(self, directory, name, schema):
+        self.schema = schema
+        self.path = os.path.join(directory, f'{name}_data.csv')
+        recover_csv(self.path)
+        self.appendable = os.path.exists(self.path) and csv_header(self.path) == list(schema)
+
+    def write(self, chunk):
+        table = ColumnTable(self.schema)
+        table.extend_prepared(chunk)
+        frame = table.to_dataframe()
+        if self.appendable:
+            append_csv(frame, self.path)
+            return
+        if os.path.exists(self.path) and csv_header(self.path):
+            stored = pd.read_csv(self.path, sep=';', dtype=str).reindex(columns=frame.columns)
+            frame = pd.concat([stored, frame.astype(object)], ignore_index=True)
+        write_csv(frame, self.path)
+        self.appendable = True
+
+    def close(self):
+        pass
+
+
+class FeatherTarget:
+    # Feather files are written whole, the rows are collected and written once at the end
+
+    def __init__(self, directory, name, schema):
+        from FeatherStore import feather_path, open_table, require_pyarrow
+        require_pyarrow()
+        self.path = feather_path(directory, name)
+        self.table = open_table(self.path, schema) if os.path.exists(self.path) else ColumnTable(schema)
+
+    def write(self, chunk):
+        self.table.extend_prepared(chunk)
+
+    def close(self):
+        from FeatherStore import write_table
+        # The stored rows still map the file, which cannot be replaced on Windows
+        self.table.make_writable()
+        write_table(self.table, self.path)
+
+
+class SqliteTarget:
+    # Each chunk is committed as one transaction
+
+    def __init__(self, conn, name, schema):
+        self.table = SqliteTable(conn, name, schema)
+
+    def write(self, chunk):
+        self.table.extend_prepared(chunk)
+
+    def close(self):
+        pass
+
+
+def import_file(name, path, target, existing, parents, sep=None, chunksize=CHUNK_ROWS):
+    # existing, parents: KeySets of the stored keys, see SchemaValidator.validate.
+    # Returns (rows read, rows accepted, error records)
+    validator = table_validator(name)
+    template = ColumnTable(table_schemas[name])
+    read = accepted = 0
+    errors = []
+    for chunk in iter_csv_chunks(path, chunksize, sep or detect_separator(path)):
+        # Rows are numbered from 1, as in the extract below its header line
+        valid, chunk_errors = validator.validate(chunk, read + 1, existing, parents)
+        read += len(chunk)
+        if len(chunk_errors):
+            errors.append(chunk_errors)
+        if valid.any():
+            chunk = chunk[valid]
+            target.write(template.prepare(chunk))
+            for column, keys in existing.items():
+                keys.add(parse_ints(chunk[column]))
+            accepted += len(chunk)
+    target.close()
+    errors = pd.concat(errors, ignore_index=True) if errors else None
+    return read, accepted, errors
+
+
+def bulk_import(files, storage='csv', directory='.', database='biobank.db', sep=None, chunksize=CHUNK_ROWS):
+    # files: list of (table name, path). Referenced tables are imported first.
+    # Returns one result dict per file.
+    order = table_order()
+    files = sorted(files, key=lambda file: order.index(file[0]))
+    conn = open_database(database) if storage == 'sqlite' else None
+    results = []
+    try:
+        for name, path in files:
+            result = {'table': name, 'path': path, 'read': 0, 'accepted': 0, 'errors': None, 'failure': None}
+            start = time.perf_counter()
+            try:
+                if storage == 'sqlite':
+                    target = SqliteTarget(conn, name, table_schemas[name])
+                elif storage == 'feather':
+                    target = FeatherTarget(directory, name, table_schemas[name])
+                else:
+                    target = CsvTarget(directory, name, table_schemas[name])
+                validator = table_validator(name)
+                existing = {column: KeySet(stored_values(storage, directory, conn, name, column))
+                            for column in validator.unique}
+                parents = {column: KeySet(stored_values(storage, directory, conn, parent, parent_column))
+                           for column, (parent, parent_column) in validator.references.items()}
+                result['read'], result['accepted'], result['errors'] = \
+                    import_file(name, path, target, existing, parents, sep, chunksize)
+            except Exception as e:
+                result['failure'] = e
+            result['seconds'] = time.perf_counter() - start
+            results.append(result)
+    finally:
+        if conn is not None:
+            conn.close()
+    return results
+
+
+def parse_file(value):
+    name, separator, path = value.partition('=')
+    if not separator or name not in table_schemas:
+        raise argparse.ArgumentTypeError(f"expected TABLE=PATH with TABLE one of {', '.join(table_schemas)}")
+    return name, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and bulk-import CSV/TSV extracts without the GUI")
+    parser.add_argument('files', nargs='+', type=parse_file, metavar='TABLE=PATH',
+                        help=f"extract to import into one of: {', '.join(table_schemas)}")
+    parser.add_argument('--storage', choices=['csv', 'feather', 'sqlite'], default='csv',
+                        help="storage backend to write")
+    parser.add_argument('--data-dir', default='.', help="directory of the CSV or Feather table files")
+    parser.add_argument('--database', default='biobank.db', help="SQLite database file for --storage sqlite")
+    parser.add_argument('--sep', help="field separator of the extracts, detected from the header by default")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS, help="rows validated and written per batch")
+    parser.add_argument('--errors', default='import_errors.csv', help="report of the rejected rows")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = bulk_import(args.files, args.storage, args.data_dir, args.database, args.sep, args.chunksize)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'table':>22} {'read':>10} {'accepted':>10} {'rejected':>10} {'seconds':>8} {'rows/s':>10}")
+    reports = []
+    for result in results:
+        rows_per_second = result['read'] / result['seconds'] if result['seconds'] else 0
+        print(f"{result['table']:>22} {result['read']:>10} {result['accepted']:>10} "
+              f"{result['read'] - result['accepted']:>10} {result['seconds']:>8.2f} {rows_per_second:>10.0f}")
+        if result['failure'] is not None:
+            print(f"Failed to import {result['path']}: {result['failure']}", file=sys.stderr)
+        if result['errors'] is not None:
+            reports.append(result['errors'].assign(table=result['table'], path=result['path']))
+    total = sum(result['read'] for result in results)
+    print(f"{total} rows in {elapsed:.2f}s, {total / elapsed if elapsed else 0:.0f} rows/s")
+
+    if reports:
+        report = pd.concat(reports, ignore_index=True)[['table', 'path', 'row', 'column', 'value', 'message']]
+        report.to_csv(args.errors, sep=';', index=False)
+        print(f"{len(report)} problems written to {args.errors}")
+    return 1 if any(result['failure'] is not None for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,481 @@
+from array import array
+from bisect import bisect_left, insort
+
+import numpy as np
+import pandas as pd
+
+# Appends grow the columns by at least this many rows at a time
+CHUNK_ROWS = 4096
+
+
+def grow(array, capacity, fill):
+    grown = np.full(capacity, fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def parse_ints(series):
+    # Integer text as exact int64, missing where blank or not an integer.
+    # Through float64, ids past 2**53 would collapse into their neighbours.
+    text = series.fillna('').astype(str)
+    blank = (text.str.strip() == '').to_numpy(dtype=bool)
+    try:
+        numbers = text.where(~blank, '0').astype('int64').to_numpy()
+        missing = blank
+    except (TypeError, ValueError, OverflowError):
+        # Only on the odd bad file: the plain integers are still parsed
+        # exactly, numbers such as 2.0 or 1e3 are taken by their float value
+        text = text.str.strip()
+        digits = text.str.fullmatch(r'[+-]?\d{1,18}').to_numpy(dtype=bool)
+        numbers = np.zeros(len(text), dtype=np.int64)
+        numbers[digits] = text[digits].astype('int64').to_numpy()
+        floats = pd.to_numeric(text.where(~digits & ~blank), errors='coerce').to_numpy(dtype=float)
+        with np.errstate(invalid='ignore'):
+            integral = (floats % 1 == 0) & (np.abs(floats) < 2.0 ** 63)
+        numbers[integral] = floats[integral].astype(np.int64)
+        missing = ~digits & ~integral
+    return pd.Series(pd.arrays.IntegerArray(numbers, missing), index=series.index, name=series.name)
+
+
+def coerce_str(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return str(value)
+
+
+class IntColumn:
+    # int64 values plus a validity mask, blanks are stored as missing
+
+    def __init__(self, name, capacity=0):
+        self.name = name
+        self.values = np.zeros(capacity, dtype=np.int64)
+        self.valid = np.zeros(capacity, dtype=bool)
+
+    def reserve(self, capacity):
+        self.values = grow(self.values, capacity, 0)
+        self.valid = grow(self.valid, capacity, False)
+
+    def coerce(self, value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        if isinstance(value, str):
+            value = value.strip()
+            if not value:
+                return None
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            number = None
+        if number is None or (isinstance(value, float) and number != value):
+            raise ValueError(f"{self.name}: expected an integer, got {value!r}")
+        return number
+
+    def set(self, row_id, value):
+        value = self.coerce(value)
+        self.values[row_id] = 0 if value is None else value
+        self.valid[row_id] = value is not None
+
+    def prepare(self, series):
+        # Parses a column chunk without touching the table, safe on worker threads
+        numbers = parse_ints(series)
+        blank = series.isna() | (series.astype(str).str.strip() == '')
+        bad = numbers.isna() & ~blank
+        if bad.any():
+            raise ValueError(f"{self.name}: expected integers, got {series[bad].iloc[0]!r} "
+                             f"and {int(bad.sum()) - 1} more invalid values")
+        return numbers.to_numpy(dtype=np.int64, na_value=0), numbers.notna().to_numpy()
+
+    def put(self, start, prepared):
+        values, valid = prepared
+        self.values[start:start + len(values)] = values
+        self.valid[start:start + len(valid)] = valid
+
+    def adopt(self, values, valid):
+        # Takes over existing arrays, e.g. read-only views of a memory-mapped file
+        self.values = values
+        self.valid = valid
+
+    def make_writable(self):
+        if not self.values.flags.writeable:
+            self.values = self.values.copy()
+        if not self.valid.flags.writeable:
+            self.valid = self.valid.copy()
+
+    def get(self, row_id):
+        return int(self.values[row_id]) if self.valid[row_id] else None
+
+    def keys(self, row_ids):
+        return self.values[row_ids], ~self.valid[row_ids]
+
+    def decode(self, keys):
+        return keys.tolist()
+
+    def display(self, row_ids):
+        return [value if valid else '' for value, valid in
+                zip(self.values[row_ids].tolist(), self.valid[row_ids].tolist())]
+
+    def to_series(self, row_ids):
+        return pd.Series(pd.arrays.IntegerArray(self.values[row_ids], ~self.valid[row_ids]), name=self.name)
+
+
+class StrColumn:
+    # Dictionary-encoded strings: int32 codes into a list of distinct values, -1 is missing
+
+    def __init__(self, name, capacity=0):
+        self.name = name
+        self.codes = np.full(capacity, -1, dtype=np.int32)
+        self.categories = []
+        self.lookup = {}
+
+    def reserve(self, capacity):
+        self.codes = grow(self.codes, capacity, -1)
+
+    def encode(self, value):
+        value = coerce_str(value)
+        if value is None:
+            return -1
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def coerce(self, value):
+        code = self.encode(value)
+        return None if code < 0 else self.categories[code]
+
+    def set(self, row_id, value):
+        self.codes[row_id] = self.encode(value)
+
+    def prepare(self, series):
+        codes, uniques = pd.factorize(series)
+        return codes, [str(value) for value in uniques]
+
+    def put(self, start, prepared):
+        codes, uniques = prepared
+        # Only the distinct values of the chunk go through the dictionary
+        mapping = np.array([self.encode(value) for value in uniques] + [-1], dtype=np.int32)
+        self.codes[start:start + len(codes)] = mapping[codes]
+
+    def adopt(self, codes, categories):
+        self.codes = codes
+        self.categories = list(categories)
+        self.lookup = {value: code for code, value in enumerate(self.categories)}
+
+    def make_writable(self):
+        if not self.codes.flags.writeable:
+            self.codes = self.codes.copy()
+
+    def get(self, row_id):
+        code = self.codes[row_id]
+        return None if code < 0 else self.categories[code]
+
+    def keys(self, row_ids):
+        codes = self.codes[row_ids]
+        return codes.astype(np.int64), codes < 0
+
+    def decode(self, keys):
+        return [self.categories[code] for code in keys.tolist()]
+
+    def display(self, row_ids):
+        categories = self.categories
+        return [categories[code] if code >= 0 else '' for code in self.codes[row_ids].tolist()]
+
+    def to_series(self, row_ids):
+        # Categories can hold values that were later overwritten or deleted
+        values = pd.Categorical.from_codes(self.codes[row_ids], categories=pd.Index(self.categories, dtype=object))
+        return pd.Series(values, name=self.name).cat.remove_unused_categories()
+
+
+class HashIndex:
+    # Secondary index of one column: value -> ascending row ids of the live rows
+
+    def __init__(self, column):
+        self.column = column
+        # None until built, lazily indexed tables build it on the first lookup
+        self.rows = None
+
+    def build(self, row_ids):
+        self.rows = {}
+        self.add_many(row_ids)
+
+    def add(self, row_id):
+        rows = self.rows.setdefault(self.column.get(row_id), array('q'))
+        if rows and rows[-1] > row_id:
+            insort(rows, row_id)
+        else:
+            rows.append(row_id)
+
+    def add_many(self, row_ids):
+        # Groups a block of ascending row ids by value with one sort
+        keys, missing = self.column.keys(row_ids)
+        self._add_group(None, row_ids[missing])
+        keys, row_ids = keys[~missing], row_ids[~missing]
+        order = np.argsort(keys, kind='stable')
+        keys, row_ids = keys[order], row_ids[order]
+        uniques, first = np.unique(keys, return_index=True)
+        for key, group in zip(self.column.decode(uniques), np.split(row_ids, first[1:])):
+            self._add_group(key, group)
+
+    def remove(self, row_id):
+        key = self.column.get(row_id)
+        rows = self.rows[key]
+        del rows[bisect_left(rows, row_id)]
+        if not rows:
+            del self.rows[key]
+
+    def lookup(self, value):
+        rows = self.rows.get(value)
+        if rows is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.frombuffer(rows, dtype=np.int64).copy()
+
+    def _add_group(self, key, row_ids):
+        if not len(row_ids):
+            return
+        rows = self.rows.get(key)
+        if rows is None:
+            self.rows[key] = array('q', row_ids.astype(np.int64).tobytes())
+        elif rows[-1] < row_ids[0]:
+            rows.frombytes(row_ids.astype(np.int64).tobytes())
+        else:
+            merged = np.union1d(np.frombuffer(rows, dtype=np.int64), row_ids)
+            self.rows[key] = array('q', merged.tobytes())
+
+
+class ColumnTable:
+    # Schema-typed, column-oriented table. Rows are addressed by a stable
+    # row id; deleted rows are only tombstoned until the table is compacted.
+
+    column_types = {'int': IntColumn, 'str': StrColumn}
+
+    def __init__(self, schema, indexes=(), lazy_indexes=False):
+        self.schema = dict(schema)
+        self.columns = {name: self.column_types[kind](name) for name, kind in self.schema.items()}
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0
+        self.deleted = 0
+        # Bumped by every change, lets derived data such as sort orders tell they are stale
+        self.version = 0
+        # Bumped by updates and deletions only: derived data that just sees
+        # the table grow can fold in the appended rows instead of starting over
+        self.edits = 0
+        # Change tracking against the table's file: rows stored in it, stored
+        # rows edited or deleted since, and whether it must be fully rewritten
+        self.saved = np.zeros(0, dtype=bool)
+        self.changed = set()
+        self.removed = 0
+        self.force_rewrite = True
+        # Header of the CSV file the rows were loaded from
+        self.file_columns = None
+        # Only the first rows of the file were loaded, rewriting it would drop the rest
+        self.partial = False
+        self.indexes = {}
+        self.lazy_indexes = lazy_indexes
+        for name in indexes:
+            self.create_index(name)
+
+    def __len__(self):
+        return self.size - self.deleted
+
+    def reserve(self, rows):
+        needed = self.size + rows
+        if needed <= len(self.alive):
+            return
+        capacity = max(needed, len(self.alive) + max(CHUNK_ROWS, len(self.alive) // 2))
+        for column in self.columns.values():
+            column.reserve(capacity)
+        self.alive = grow(self.alive, capacity, False)
+        self.saved = grow(self.saved, capacity, False)
+
+    def create_index(self, name):
+        index = self.indexes[name] = HashIndex(self.columns[name])
+        if not self.lazy_indexes:
+            index.build(self.row_ids())
+        return index
+
+    def built_indexes(self):
+        return [index for index in self.indexes.values() if index.rows is not None]
+
+    def coerce(self, entry):
+        return {name: column.coerce(entry.get(name)) for name, column in self.columns.items()}
+
+    def append(self, entry):
+        entry = self.coerce(entry)
+        self.reserve(1)
+        row_id = self.size
+        for name, column in self.columns.items():
+            column.set(row_id, entry[name])
+        self.alive[row_id] = True
+        self.size += 1
+        self.version += 1
+        for index in self.built_indexes():
+            index.add(row_id)
+        return row_id
+
+    def prepare(self, frame):
+        # Column-wise parsing of a DataFrame chunk; the result is applied with extend_prepared
+        columns = {name: column.prepare(frame[name].reset_index(drop=True))
+                   for name, column in self.columns.items() if name in frame}
+        return len(frame), columns
+
+    def extend(self, frame):
+        return self.extend_prepared(self.prepare(frame))
+
+    def extend_prepared(self, chunk, saved=False):
+        # saved: the rows come from the table's own file, e.g. while loading it
+        rows, columns = chunk
+        self.reserve(rows)
+        start = self.size
+        for name, prepared in columns.items():
+            self.columns[name].put(start, prepared)
+        self.alive[start:start + rows] = True
+        self.saved[start:start + rows] = saved
+        self.size += rows
+        self.version += 1
+        for index in self.built_indexes():
+            index.add_many(np.arange(start, start + rows, dtype=np.int64))
+        return range(start, start + rows)
+
+    def make_writable(self):
+        # Copies the columns still viewing a memory-mapped file into memory,
+        # after which the file can be replaced
+        for column in self.columns.values():
+            column.make_writable()
+
+    def update(self, row_id, entry):
+        entry = self.coerce(entry)
+        self.make_writable()
+        for index in self.built_indexes():
+            index.remove(row_id)
+        for name, column in self.columns.items():
+            column.set(row_id, entry[name])
+        for index in self.built_indexes():
+            index.add(row_id)
+        self.version += 1
+        self.edits += 1
+        if self.saved[row_id]:
+            self.changed.add(row_id)
+
+    def delete(self, row_id):
+        if self.alive[row_id]:
+            if self.saved[row_id]:
+                self.removed += 1
+            for index in self.built_indexes():
+                index.remove(row_id)
+            self.alive[row_id] = False
+            self.deleted += 1
+            self.version += 1
+            self.edits += 1
+
+    def get(self, row_id):
+        return {name: column.get(row_id) for name, column in self.columns.items()}
+
+    def mark_loaded(self, partial=False):
+        # The table now mirrors its file, or its first rows when the load was
+        # cancelled; later saves only write the changes. Rows are only
+        # appended to a file with the table's columns in the table's order,
+        # any other file is rewritten whole.
+        self.force_rewrite = self.file_columns != list(self.columns)
+        self.partial = partial
+
+    def needs_rewrite(self):
+        return bool(self.force_rewrite or self.changed or self.removed)
+
+    def begin_save(self):
+        # Returns (rewrite, row ids to write): a full rewrite when stored rows
+        # were edited or deleted, otherwise only the rows added since the last
+        # save. The rows count as saved from here on, abort_save() undoes that.
+        rewrite = self.needs_rewrite()
+        if rewrite:
+            row_ids = self.row_ids()
+            self.saved[:self.size] = self.alive[:self.size]
+        else:
+            row_ids = np.flatnonzero(self.alive[:self.size] & ~self.saved[:self.size]).astype(np.int64)
+            self.saved[row_ids] = True
+        self.changed.clear()
+        self.removed = 0
+        self.force_rewrite = False
+        return rewrite, row_ids
+
+    def abort_save(self):
+        # The file is in an unknown state, the next save rewrites it
+        self.force_rewrite = True
+
+    def row_ids(self):
+        if not self.deleted:
+            return np.arange(self.size, dtype=np.int64)
+        return np.flatnonzero(self.alive[:self.size]).astype(np.int64)
+
+    def find(self, name, value):
+        column = self.columns[name]
+        if name in self.indexes:
+            if isinstance(column, IntColumn):
+                try:
+                    value = column.coerce(value)
+                except ValueError:
+                    return np.zeros(0, dtype=np.int64)
+            elif value is not None:
+                value = str(value)
+            index = self.indexes[name]
+            if index.rows is None:
+                index.build(self.row_ids())
+            return index.lookup(value)
+        if isinstance(column, IntColumn):
+            try:
+                value = column.coerce(value)
+            except ValueError:
+                return np.zeros(0, dtype=np.int64)
+            if value is None:
+                match = ~column.valid[:self.size]
+            else:
+                match = column.valid[:self.size] & (column.values[:self.size] == value)
+        else:
+            code = -1 if value is None else column.lookup.get(str(value))
+            if code is None:
+                return np.zeros(0, dtype=np.int64)
+            match = column.codes[:self.size] == code
+        return np.flatnonzero(match & self.alive[:self.size]).astype(np.int64)
+
+    def rows(self, row_ids):
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        return [list(row) for row in zip(*(column.display(row_ids) for column in self.columns.values()))]
+
+    def values(self, name, row_ids=None):
+        # One column of the live rows as a Series, e.g. for key checks
+        if row_ids is None:
+            row_ids = self.row_ids()
+        return self.columns[name].to_series(row_ids)
+
+    def to_dataframe(self, row_ids=None):
+        if row_ids is None:
+            row_ids = self.row_ids()
+        return pd.DataFrame({name: column.to_series(row_ids) for name, column in self.columns.items()})
+
+    @classmethod
+    def from_columns(cls, schema, size, columns, indexes=()):
+        # Wraps already typed column arrays without copying them; indexes
+        # are only built once they are first queried
+        table = cls(schema, indexes, lazy_indexes=True)
+        for name, column in table.columns.items():
+            if name in columns:
+                column.adopt(*columns[name])
+            else:
+                column.reserve(size)
+        table.alive = np.ones(size, dtype=bool)
+        table.saved = np.ones(size, dtype=bool)
+        table.size = size
+        table.force_rewrite = False
+        return table
+
+    @classmethod
+    def from_dataframe(cls, schema, frame, indexes=()):
+        table = cls(schema, indexes)
+        table.extend(frame)
+        return table
+
+
+def read_csv(path, schema, sep=';', indexes=()):
+    # Every column is read as text and typed by the table, not by pandas inference
+    return ColumnTable.from_dataframe(schema, pd.read_csv(path, sep=sep, dtype=str), indexes)
+
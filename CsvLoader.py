@@ -0,0 +1,204 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from ColumnStore import ColumnTable
+from Profiling import span
+from Tasks import Cancelled, Task
+from Validation import KeySet, table_validator
+
+# Rows parsed per chunk, peak memory of a load is bounded by this
+CHUNK_ROWS = 20000
+# Parsed chunks waiting for the UI thread before the readers block
+MAX_PENDING_CHUNKS = 8
+
+
+def iter_csv_chunks(path, chunksize=CHUNK_ROWS, sep=';'):
+    # Every column is read as text and typed by the table, not by pandas inference
+    with pd.read_csv(path, sep=sep, dtype=str, chunksize=chunksize) as reader:
+        while True:
+            with span('csv.parse', path=path) as parsed:
+                chunk = next(reader, None)
+                parsed.set(rows=0 if chunk is None else len(chunk))
+            if chunk is None:
+                return
+            yield chunk
+
+
+def csv_header(path, sep=';'):
+    # Column names of a CSV file in their order, none for an empty file
+    try:
+        return list(pd.read_csv(path, sep=sep, dtype=str, nrows=0).columns)
+    except pd.errors.EmptyDataError:
+        return []
+
+
+def write_csv(frame, path, sep=';'):
+    # Written next to the target and renamed over it, a crash leaves the old file intact
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        frame.to_csv(f, sep=sep, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def append_csv(frame, path, sep=';'):
+    # The rows and the original file length first go to a durable journal,
+    # so an interrupted append is rolled forward by recover_csv
+    journal = path + '.journal'
+    with open(journal + '.tmp', 'w', newline='') as f:
+        f.write(f'{os.path.getsize(path)}\n')
+        frame.to_csv(f, sep=sep, index=False, header=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(journal + '.tmp', journal)
+    recover_csv(path)
+
+
+def recover_csv(path):
+    journal = path + '.journal'
+    if not os.path.exists(journal):
+        return
+    with open(journal, 'rb') as f:
+        length = int(f.readline())
+        rows = f.read()
+    with open(path, 'r+b') as f:
+        f.truncate(length)
+        f.seek(length)
+        f.write(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(journal)
+
+
+class FileJobs(Task):
+    # Runs one job per file concurrently on a thread pool. Results are queued
+    # as (kind, table name, payload) for the owner to drain with poll():
+    # 'done', 'error' or 'cancelled' once per file, then a single 'finished'.
+    # run_file returns the number of rows it handled, recorded in its span.
+
+    span_name = 'file'
+
+    def __init__(self, files, max_pending=0, max_workers=None):
+        super().__init__(max_pending)
+        self.files = files
+        self.max_workers = max_workers
+        self.remaining = len(files)
+        self.lock = threading.Lock()
+
+    def start(self, executor=None):
+        # Runs on the given shared pool, e.g. TaskRunner.executor, or on a pool of its own
+        if not self.files:
+            self.finish('finished', None, None)
+            return self
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers or len(self.files))
+        if self.max_workers == 1:
+            # Processed one after the other, in the order given
+            executor.submit(self._run_files)
+        else:
+            for file in self.files:
+                executor.submit(self._run_file, *file)
+        if own_executor:
+            executor.shutdown(wait=False)
+        return self
+
+    def run_file(self, name, path, arg):
+        raise NotImplementedError
+
+    def _run_files(self):
+        for file in self.files:
+            self._run_file(*file)
+
+    def _run_file(self, name, path, arg):
+        # The file's last event is queued even once cancelled, and 'finished'
+        # follows the last file whatever happened to it
+        try:
+            try:
+                self.check_cancelled()
+                with span(self.span_name, table=name) as timed:
+                    timed.set(rows=self.run_file(name, path, arg))
+                self.put_final('done', name, path)
+            except Cancelled:
+                self.put_final('cancelled', name, path)
+            except Exception as e:
+                self.put_final('error', name, e)
+        finally:
+            with self.lock:
+                self.remaining -= 1
+                finished = not self.remaining
+            if finished:
+                self.finish('finished', None, None)
+
+
+class CsvLoader(FileJobs):
+    # Streams CSV files in chunks. Each chunk is validated, parsed and typed
+    # on the worker, the owner applies it with ColumnTable.extend_prepared.
+    # Rows failing the schema checks are left out and reported as
+    # ('invalid', table name, error records). The file's columns are
+    # reported first as ('header', table name, column names).
+
+    span_name = 'csv.load'
+
+    def __init__(self, files, chunksize=CHUNK_ROWS):
+        # files: list of (table name, path, table schema)
+        super().__init__(files, MAX_PENDING_CHUNKS)
+        self.chunksize = chunksize
+
+    def run_file(self, name, path, schema):
+        recover_csv(path)
+        header = csv_header(path)
+        self.put('header', name, header)
+        if not header:
+            # Empty, as saved from an empty table
+            return 0
+        template = ColumnTable(schema)
+        validator = table_validator(name)
+        # Keys of the earlier chunks, so duplicates across chunks are caught too
+        existing = {column: KeySet() for column in validator.unique}
+        rows = 0
+        for chunk in iter_csv_chunks(path, self.chunksize):
+            self.check_cancelled()
+            with span('validate', table=name, rows=len(chunk)):
+                valid, errors = validator.validate(chunk, rows + 1, existing)
+            rows += len(chunk)
+            if len(errors):
+                self.put('invalid', name, errors)
+                chunk = chunk[valid]
+            with span('prepare', table=name, rows=len(chunk)):
+                prepared = template.prepare(chunk)
+            for column, keys in existing.items():
+                # Integer keys as already parsed by prepare
+                if schema[column] == 'int':
+                    values, valid = prepared[1][column]
+                    keys.add(values[valid])
+                else:
+                    keys.add(chunk[column])
+            self.put('chunk', name, prepared)
+        return rows
+
+
+class CsvSaver(FileJobs):
+    # files: list of (table name, path, (rewrite, table, row ids)). The row
+    # ids are the whole table when rewriting, otherwise only the added rows;
+    # their snapshot is taken on the worker.
+
+    span_name = 'csv.save'
+
+    def run_file(self, name, path, job):
+        rewrite, table, row_ids = job
+        with span('snapshot', table=name, rows=len(row_ids)):
+            frame = table.to_dataframe(row_ids)
+        recover_csv(path)
+        if rewrite or not os.path.exists(path):
+            write_csv(frame, path)
+        elif csv_header(path) != list(frame.columns):
+            # Changed since it was loaded, the rows would land under other headings
+            raise ValueError(f"{path} no longer has the table's columns, save again to rewrite it")
+        else:
+            append_csv(frame, path)
+        return len(frame)
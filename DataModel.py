@@ -1,5 +1,3 @@
-import pandas as pd
-
 # Define the data schema
 miabis_schema = {
     'biobank_id': 'int',
@@ -88,9 +86,60 @@ procedure_occurrence_schema = {
     'qualifier_source_value': 'str'
 }
 
-# Example of creating DataFrames with the defined schema
-miabis_df = pd.DataFrame(columns=miabis_schema.keys()).astype(miabis_schema)
-sprec_df = pd.DataFrame(columns=sprec_schema.keys()).astype(sprec_schema)
-omop_person_df = pd.DataFrame(columns=omop_person_schema.keys()).astype(omop_person_schema)
-condition_occurrence_df = pd.DataFrame(columns=condition_occurrence_schema.keys()).astype(condition_occurrence_schema)
-procedure_occurrence_df = pd.DataFrame(columns=procedure_occurrence_schema.keys()).astype(procedure_occurrence_schema)
\ No newline at end of file
+# SPREC samples also record the donor they were taken from
+sprec_table_schema = dict(sprec_schema, person_id='int')
+
+# Tables stored by the application, keyed by the name used for their files
+table_schemas = {
+    'miabis': miabis_schema,
+    'sprec': sprec_table_schema,
+    'omop_person': omop_person_schema,
+    'condition_occurrence': condition_occurrence_schema,
+    'procedure_occurrence': procedure_occurrence_schema
+}
+
+# Columns with a maintained hash index, used by the per-patient drill-downs
+table_indexes = {
+    'sprec': ['person_id'],
+    'condition_occurrence': ['person_id'],
+    'procedure_occurrence': ['person_id']
+}
+
+# Identifier of each table, referenced by the foreign keys below
+table_primary_keys = {
+    'miabis': 'biobank_id',
+    'sprec': 'sample_id',
+    'omop_person': 'person_id',
+    'condition_occurrence': 'condition_occurrence_id',
+    'procedure_occurrence': 'procedure_occurrence_id'
+}
+
+# Foreign keys: table -> {column: (referenced table, referenced column)}
+table_foreign_keys = {
+    'sprec': {'biobank_id': ('miabis', 'biobank_id'), 'person_id': ('omop_person', 'person_id')},
+    'condition_occurrence': {'person_id': ('omop_person', 'person_id')},
+    'procedure_occurrence': {'person_id': ('omop_person', 'person_id')}
+}
+
+# How the app shows each table: the tab title, the name on its buttons and
+# messages (the title by default), the number of field pairs per form row,
+# the forms its person_id can be carried to, and whether its table then lists
+# that person's rows only. A table declared above without an entry here gets
+# a one-column form titled after its name.
+table_forms = {
+    'miabis': {'title': 'MIABIS', 'columns': 2},
+    'sprec': {'title': 'SPREC', 'links': ['omop_person']},
+    'omop_person': {'title': 'OMOP Person', 'columns': 2, 'links': ['condition_occurrence', 'procedure_occurrence']},
+    'condition_occurrence': {'title': 'Condition Occurrence', 'label': 'Condition', 'per_person': True},
+    'procedure_occurrence': {'title': 'Procedure Occurrence', 'label': 'Procedure', 'per_person': True}
+}
+
+
+def table_form(name):
+    form = dict(table_forms.get(name, {}))
+    form.setdefault('title', name.replace('_', ' ').title())
+    form.setdefault('label', form['title'])
+    form.setdefault('columns', 1)
+    form.setdefault('links', [])
+    form.setdefault('per_person', False)
+    return form
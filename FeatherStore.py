@@ -0,0 +1,127 @@
+import argparse
+import os
+
+import numpy as np
+
+from ColumnStore import ColumnTable, IntColumn, read_csv
+from CsvLoader import FileJobs
+from DataModel import table_schemas
+
+# pyarrow is optional, it is only needed for the binary storage backend
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def feather_path(directory, name):
+    return os.path.join(directory, f'{name}_data.feather')
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The Feather storage backend requires pyarrow (pip install pyarrow)")
+
+
+def to_arrow(table, row_ids=None):
+    # Copies the live rows into an uncompressed Arrow table, with the string
+    # columns kept dictionary encoded
+    require_pyarrow()
+    if row_ids is None:
+        row_ids = table.row_ids()
+    arrays = []
+    for column in table.columns.values():
+        if isinstance(column, IntColumn):
+            arrays.append(pa.array(column.values[row_ids], type=pa.int64(), mask=~column.valid[row_ids]))
+        else:
+            codes = column.codes[row_ids]
+            indices = pa.array(codes, type=pa.int32(), mask=codes < 0)
+            arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(column.categories, type=pa.string())))
+    return pa.Table.from_arrays(arrays, names=list(table.columns))
+
+
+def write_arrow(arrow_table, path):
+    # Written as a single record batch so the reopened columns are contiguous,
+    # then renamed over the previous file
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table, max_chunksize=max(arrow_table.num_rows, 1))
+    os.replace(tmp_path, path)
+
+
+def write_table(table, path):
+    write_arrow(to_arrow(table), path)
+
+
+def buffer_view(array, dtype):
+    # Zero-copy NumPy view of the values buffer of a primitive Arrow array
+    data = array.buffers()[1]
+    return np.frombuffer(data, dtype=dtype, count=len(array), offset=array.offset * np.dtype(dtype).itemsize)
+
+
+def open_table(path, schema, indexes=()):
+    # Memory-maps the file: int values and string codes stay in the page
+    # cache and are only read when a page of the table is viewed
+    require_pyarrow()
+    source = pa.memory_map(path, 'r')
+    arrow_table = pa.ipc.open_file(source).read_all().combine_chunks()
+    columns = {}
+    for name, kind in schema.items():
+        if name not in arrow_table.column_names:
+            continue
+        chunks = arrow_table.column(name).chunks
+        if not chunks:
+            continue
+        array = chunks[0]
+        if kind == 'int':
+            array = array.cast(pa.int64())
+            valid = np.ones(len(array), dtype=bool) if not array.null_count else \
+                array.is_valid().to_numpy(zero_copy_only=False)
+            columns[name] = (buffer_view(array, np.int64), valid)
+        else:
+            if not pa.types.is_dictionary(array.type):
+                array = array.cast(pa.string()).dictionary_encode()
+            codes = buffer_view(array.indices.cast(pa.int32()), np.int32)
+            if array.null_count:
+                codes = np.where(array.is_valid().to_numpy(zero_copy_only=False), codes, -1).astype(np.int32)
+            columns[name] = (codes, array.dictionary.to_pylist())
+    return ColumnTable.from_columns(schema, arrow_table.num_rows, columns, indexes)
+
+
+class FeatherSaver(FileJobs):
+    # files: list of (table name, path, (table, row ids)); the Arrow snapshot
+    # of the rows is taken on the worker
+
+    span_name = 'feather.save'
+
+    def run_file(self, name, path, job):
+        table, row_ids = job
+        write_arrow(to_arrow(table, row_ids), path)
+        return len(row_ids)
+
+
+def convert_csv(csv_dir, out_dir):
+    # Converts existing semicolon separated exports to typed Feather files
+    require_pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    for name, schema in table_schemas.items():
+        csv_path = os.path.join(csv_dir, f'{name}_data.csv')
+        if not os.path.exists(csv_path):
+            print(f"Skipping {name}: {csv_path} not found")
+            continue
+        table = read_csv(csv_path, schema)
+        write_table(table, feather_path(out_dir, name))
+        print(f"Converted {csv_path}: {len(table)} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert CSV exports to the Feather storage format")
+    parser.add_argument('--csv-dir', default='.', help="directory holding the <table>_data.csv files")
+    parser.add_argument('--out-dir', default='.', help="directory for the <table>_data.feather files")
+    args = parser.parse_args()
+    convert_csv(args.csv_dir, args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import itertools
+import sys
+import time
+import traceback
+import types
+
+# Stand-in for the tkinter widgets the app uses, for benchmarks on machines
+# without a display. Widgets keep their options and items in plain Python
+# objects and root.after callbacks run from update(), so everything above
+# the Tk layer, VirtualTreeview included, runs unchanged.
+
+ids = itertools.count()
+
+
+class TclError(Exception):
+    pass
+
+
+class Misc:
+    def __init__(self, master=None, cnf=None, **kw):
+        self.master = master
+        self.options = dict(cnf or {}, **kw)
+        self.bindings = {}
+        self.name = f'.!widget{next(ids)}'
+
+    def __str__(self):
+        return self.name
+
+    def root(self):
+        widget = self
+        while widget.master is not None:
+            widget = widget.master
+        return widget
+
+    def configure(self, cnf=None, **kw):
+        self.options.update(cnf or {}, **kw)
+
+    config = configure
+
+    def cget(self, key):
+        return self.options.get(key, '')
+
+    def __getitem__(self, key):
+        return self.cget(key)
+
+    def bind(self, sequence, function, add=None):
+        self.bindings.setdefault(sequence, []).append(function)
+
+    def event_generate(self, sequence, **kw):
+        for function in self.bindings.get(sequence, []):
+            function(types.SimpleNamespace(widget=self, **kw))
+
+    def grid(self, **kw):
+        pass
+
+    def pack(self, **kw):
+        pass
+
+    def grid_rowconfigure(self, *args, **kw):
+        pass
+
+    def grid_columnconfigure(self, *args, **kw):
+        pass
+
+    def grid_size(self):
+        return 4, 1
+
+    def winfo_width(self):
+        return 1000
+
+    def winfo_height(self):
+        return 500
+
+    def update_idletasks(self):
+        pass
+
+    def after(self, ms, function, *args):
+        return self.root().after(ms, function, *args)
+
+    def after_cancel(self, after_id):
+        self.root().after_cancel(after_id)
+
+    def after_idle(self, function, *args):
+        return self.after(0, function, *args)
+
+    def destroy(self):
+        pass
+
+
+class Tk(Misc):
+    def __init__(self):
+        super().__init__()
+        self.timers = {}
+
+    def title(self, text):
+        self.options['title'] = text
+
+    def protocol(self, name, function):
+        self.options[name] = function
+
+    def withdraw(self):
+        pass
+
+    def after(self, ms, function, *args):
+        after_id = f'after#{next(ids)}'
+        self.timers[after_id] = (time.perf_counter() + ms / 1000, function, args)
+        return after_id
+
+    def after_cancel(self, after_id):
+        self.timers.pop(after_id, None)
+
+    def update(self):
+        # Runs the callbacks that are due, like one pass of the Tk event loop
+        now = time.perf_counter()
+        for after_id in sorted((after_id for after_id, timer in self.timers.items() if timer[0] <= now),
+                               key=lambda after_id: self.timers[after_id][0]):
+            timer = self.timers.pop(after_id, None)
+            if timer is not None:
+                timer[1](*timer[2])
+
+    def report_callback_exception(self, kind, value, trace):
+        traceback.print_exception(kind, value, trace, file=sys.stderr)
+
+    def mainloop(self):
+        while self.timers:
+            self.update()
+            time.sleep(0.001)
+
+
+class Toplevel(Misc):
+    def title(self, text):
+        self.options['title'] = text
+
+    def protocol(self, name, function):
+        self.options[name] = function
+
+    def lift(self):
+        pass
+
+
+class Entry(Misc):
+    def __init__(self, master=None, cnf=None, **kw):
+        super().__init__(master, cnf, **kw)
+        self.text = ''
+
+    def get(self):
+        return self.text
+
+    def delete(self, first, last=None):
+        self.text = ''
+
+    def insert(self, index, text):
+        self.text = str(text) + self.text
+
+
+class Combobox(Entry):
+    def current(self, index):
+        self.text = list(self.options['values'])[index]
+
+
+class Notebook(Misc):
+    def __init__(self, master=None, cnf=None, **kw):
+        super().__init__(master, cnf, **kw)
+        self.pages = []
+        self.selected = ''
+
+    def add(self, child, **kw):
+        self.pages.append(str(child))
+        self.selected = self.selected or str(child)
+
+    def select(self, tab_id=None):
+        if tab_id is None:
+            return self.selected
+        self.selected = str(tab_id)
+        self.event_generate('<<NotebookTabChanged>>')
+
+    def tabs(self):
+        return list(self.pages)
+
+
+class Scrollbar(Misc):
+    def set(self, first, last):
+        self.options['position'] = (first, last)
+
+
+class Treeview(Misc):
+    def __init__(self, master=None, cnf=None, **kw):
+        super().__init__(master, cnf, **kw)
+        self.options.setdefault('height', 10)
+        self.items = {}
+        self.headings = {}
+        self.widths = {}
+        self.selected = ()
+
+    def insert(self, parent, index, iid=None, **kw):
+        iid = iid or f'I{next(ids)}'
+        self.items[iid] = kw.get('values', ())
+        return iid
+
+    def delete(self, *items):
+        for iid in items:
+            del self.items[iid]
+
+    def item(self, iid, **kw):
+        if 'values' in kw:
+            self.items[iid] = kw['values']
+        return {'values': self.items[iid]}
+
+    def get_children(self, item=''):
+        return tuple(self.items)
+
+    def heading(self, column, **kw):
+        self.headings.setdefault(column, {}).update(kw)
+        return self.headings[column]
+
+    def column(self, column, **kw):
+        if kw.get('width') is not None:
+            self.widths[column] = kw['width']
+        return self.widths.get(column, 100)
+
+    def bbox(self, item, column=None):
+        return 0, 25, 1000, 20
+
+    def selection(self):
+        return self.selected
+
+    def selection_set(self, items):
+        self.selected = tuple(items)
+
+    def see(self, item):
+        pass
+
+    def xview(self, *args):
+        return 0.0, 1.0
+
+    def yview(self, *args):
+        return 0.0, 1.0
+
+
+def install():
+    # Registers the stand-in as tkinter; has to run before tkinter or any
+    # module using it is imported
+    tk = types.ModuleType('tkinter')
+    ttk = types.ModuleType('tkinter.ttk')
+    messagebox = types.ModuleType('tkinter.messagebox')
+    filedialog = types.ModuleType('tkinter.filedialog')
+    tk.TclError, tk.Misc, tk.Tk, tk.Toplevel = TclError, Misc, Tk, Toplevel
+    tk.Frame = tk.Label = tk.Button = Misc
+    tk.Entry = Entry
+    for name in ['END', 'LEFT', 'RIGHT', 'TOP', 'BOTTOM', 'X', 'Y', 'BOTH', 'DISABLED', 'NORMAL']:
+        setattr(tk, name, name.lower())
+    ttk.Frame = ttk.Label = ttk.Button = Misc
+    ttk.Entry, ttk.Combobox, ttk.Notebook, ttk.Scrollbar, ttk.Treeview = Entry, Combobox, Notebook, Scrollbar, Treeview
+    for name in ['showinfo', 'showwarning', 'showerror']:
+        setattr(messagebox, name, lambda title, message, **kw: 'ok')
+    filedialog.asksaveasfilename = lambda **kw: ''
+    tk.ttk, tk.messagebox, tk.filedialog = ttk, messagebox, filedialog
+    sys.modules.update({'tkinter': tk, 'tkinter.ttk': ttk, 'tkinter.messagebox': messagebox,
+                        'tkinter.filedialog': filedialog})
+    return tk
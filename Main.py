@@ -1,10 +1,25 @@
+import argparse
 import tkinter as tk
+import Profiling
 from BiobankApp import BiobankApp
 
 def main():
+    parser = argparse.ArgumentParser(description="Biobank Data Entry and Exploration")
+    parser.add_argument('--storage', choices=['csv', 'feather', 'sqlite'], default='csv',
+                        help="storage used by the Save and Load buttons")
+    parser.add_argument('--database', default='biobank.db', help="SQLite database file for --storage sqlite")
+    parser.add_argument('--profile', action='store_true',
+                        help="record timings from the start, see the Diagnostics window")
+    parser.add_argument('--trace', help="record timings and write them to this trace file on exit")
+    args = parser.parse_args()
+
+    if args.profile or args.trace:
+        Profiling.enable()
     root = tk.Tk()
-    app = BiobankApp(root)
+    app = BiobankApp(root, storage=args.storage, database=args.database)
     root.mainloop()
+    if args.trace:
+        Profiling.RECORDER.dump(args.trace)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+# Spans kept in memory, the oldest are dropped first
+MAX_SPANS = 100000
+
+
+def current_rss():
+    # Resident set size in bytes; falls back to the peak RSS off Linux
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class Span:
+    # One timed operation: with span(...) as s, or s = span(...) and s.end()
+    # when it finishes in a later callback. Counts such as rows are passed
+    # to set() or end().
+
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.name = name
+        self.fields = fields
+        self.thread = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.rss = current_rss()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+        return self
+
+    def end(self, **fields):
+        self.fields.update(fields)
+        self.recorder.add(self, time.perf_counter() - self.start, current_rss() - self.rss)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is not None:
+            self.fields['error'] = kind.__name__
+        self.end()
+
+
+class NoSpan:
+    # Stands in for Span while recording is off, every call does nothing
+
+    def set(self, **fields):
+        return self
+
+    def end(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+class Recorder:
+    # Finished spans as dicts, safe to add to from any thread
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self.enabled = False
+        self.spans = collections.deque(maxlen=max_spans)
+        self.origin = time.perf_counter()
+
+    def span(self, name, **fields):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, fields)
+
+    def add(self, span, seconds, memory):
+        self.spans.append({'name': span.name, 'start': span.start - self.origin, 'seconds': seconds,
+                           'memory_delta': memory, 'thread': span.thread, **span.fields})
+
+    def clear(self):
+        self.spans.clear()
+
+    def summary(self):
+        # Per span name: count, total, mean and max seconds, rows and memory delta
+        totals = {}
+        for span in list(self.spans):
+            total = totals.setdefault(span['name'], {'name': span['name'], 'count': 0, 'seconds': 0.0,
+                                                     'max_seconds': 0.0, 'rows': 0, 'memory_delta': 0})
+            total['count'] += 1
+            total['seconds'] += span['seconds']
+            total['max_seconds'] = max(total['max_seconds'], span['seconds'])
+            total['rows'] += span.get('rows') or 0
+            total['memory_delta'] += span['memory_delta']
+        for total in totals.values():
+            total['mean_seconds'] = total['seconds'] / total['count']
+        return sorted(totals.values(), key=lambda total: total['seconds'], reverse=True)
+
+    def dump(self, path):
+        # Trace Event Format, opens in chrome://tracing or Perfetto
+        threads = {}
+        events = []
+        for span in list(self.spans):
+            tid = threads.setdefault(span['thread'], len(threads) + 1)
+            args = {key: value for key, value in span.items() if key not in ('name', 'start', 'seconds', 'thread')}
+            events.append({'name': span['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                           'ts': span['start'] * 1e6, 'dur': span['seconds'] * 1e6, 'args': args})
+        for thread, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': thread}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+RECORDER = Recorder()
+
+
+def span(name, **fields):
+    # While recording is off this costs one attribute check
+    return RECORDER.span(name, **fields)
+
+
+def enable():
+    RECORDER.enabled = True
+
+
+def disable():
+    RECORDER.enabled = False
+
+
+def enabled():
+    return RECORDER.enabled
@@ -0,0 +1,278 @@
+import numpy as np
+import pandas as pd
+
+from ColumnStore import IntColumn
+from Profiling import span
+from SqliteStore import SqliteTable
+
+OPERATORS = ['contains', 'starts with', '=', 'between', 'in']
+
+
+def like_pattern(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class Equals:
+    def __init__(self, column, value):
+        self.column = column
+        self.value = value
+
+    def __str__(self):
+        return f"{self.column} = {self.value}"
+
+    def mask(self, query):
+        # Served by the column's hash index when it has one
+        mask = np.zeros(query.table.size, dtype=bool)
+        mask[query.table.find(self.column, self.value)] = True
+        return mask
+
+    def sql(self):
+        if self.value is None or str(self.value).strip() == '':
+            return f'{self.column} IS NULL', []
+        return f'{self.column} = ?', [self.value]
+
+
+class Search:
+    # Case-insensitive substring or prefix match on the displayed text
+
+    def __init__(self, column, text, prefix=False):
+        self.column = column
+        self.text = text.strip().lower()
+        self.prefix = prefix
+
+    def __str__(self):
+        return f"{self.column} {'starts with' if self.prefix else 'contains'} {self.text}"
+
+    def mask(self, query):
+        # Matched once against the distinct values, then mapped onto the rows
+        values, texts = query.distinct(self.column)
+        if self.prefix:
+            matched = texts.str.startswith(self.text)
+        else:
+            matched = texts.str.contains(self.text, regex=False)
+        return query.isin(self.column, values[matched.to_numpy(dtype=bool)])
+
+    def sql(self):
+        pattern = like_pattern(self.text) + '%'
+        if not self.prefix:
+            pattern = '%' + pattern
+        return f"LOWER(CAST({self.column} AS TEXT)) LIKE ? ESCAPE '\\'", [pattern]
+
+
+class Range:
+    # Inclusive bounds, either may be None. Text columns compare as text,
+    # which orders the YYYY-MM-DD dates chronologically.
+
+    def __init__(self, column, low=None, high=None):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def __str__(self):
+        return f"{self.column} between {self.low or '...'} and {self.high or '...'}"
+
+    def bounds(self, query):
+        if isinstance(query.table.columns[self.column], IntColumn):
+            coerce = query.table.columns[self.column].coerce
+            return coerce(self.low), coerce(self.high)
+        return self.low, self.high
+
+    def mask(self, query):
+        low, high = self.bounds(query)
+        column = query.table.columns[self.column]
+        if isinstance(column, IntColumn):
+            values = column.values[:query.table.size]
+            mask = column.valid[:query.table.size].copy()
+        else:
+            values = pd.Series(query.categories(self.column))
+            mask = np.ones(len(values), dtype=bool)
+        if low is not None:
+            mask &= np.asarray(values >= low)
+        if high is not None:
+            mask &= np.asarray(values <= high)
+        if isinstance(column, IntColumn):
+            return mask
+        return query.isin(self.column, np.flatnonzero(mask))
+
+    def sql(self):
+        clauses, parameters = [], []
+        if self.low is not None:
+            clauses.append(f'{self.column} >= ?')
+            parameters.append(self.low)
+        if self.high is not None:
+            clauses.append(f'{self.column} <= ?')
+            parameters.append(self.high)
+        return ' AND '.join(clauses) or '1', parameters
+
+
+class OneOf:
+    def __init__(self, column, values):
+        self.column = column
+        self.values = list(values)
+
+    def __str__(self):
+        return f"{self.column} in {', '.join(map(str, self.values))}"
+
+    def mask(self, query):
+        column = query.table.columns[self.column]
+        if isinstance(column, IntColumn):
+            values = [column.coerce(value) for value in self.values]
+            return query.isin(self.column, np.array([value for value in values if value is not None], dtype=np.int64))
+        codes = [column.lookup.get(str(value)) for value in self.values]
+        return query.isin(self.column, np.array([code for code in codes if code is not None], dtype=np.int64))
+
+    def sql(self):
+        return f'{self.column} IN ({", ".join("?" * len(self.values))})', list(self.values)
+
+
+def parse_condition(column, operator, text):
+    # Condition typed into a table's query bar, None while the text is empty.
+    # between takes "low..high" with either side optional, in takes a comma separated list.
+    if not text.strip():
+        return None
+    if operator == 'contains':
+        return Search(column, text)
+    if operator == 'starts with':
+        return Search(column, text, prefix=True)
+    if operator == '=':
+        return Equals(column, text.strip())
+    if operator == 'between':
+        low, separator, high = text.partition('..')
+        if not separator:
+            raise ValueError("expected low..high")
+        return Range(column, low.strip() or None, high.strip() or None)
+    if operator == 'in':
+        return OneOf(column, [value.strip() for value in text.split(',') if value.strip()])
+    raise ValueError(f"unknown operator {operator!r}")
+
+
+class TableQuery:
+    # Filter and sort state of one table view. Results are arrays of row ids
+    # for VirtualTreeview, the rows themselves are never copied. On a
+    # ColumnTable the sort permutations and distinct values are cached until
+    # the table changes; an SqliteTable is queried through its indexes.
+
+    def __init__(self, table, conditions=(), sort=None, descending=False):
+        self.table = table
+        self.conditions = list(conditions)
+        self.search = None
+        self.sort = sort
+        self.descending = descending
+        self.permutations = {}
+        self.distinct_values = {}
+
+    def is_plain(self):
+        # Rows in storage order, new rows can be patched in at the end
+        return not self.conditions and self.search is None and self.sort is None
+
+    def active_conditions(self, extra=()):
+        return list(extra) + self.conditions + ([self.search] if self.search is not None else [])
+
+    def run(self, extra=(), conn=None):
+        # conn: a connection of the calling thread to an SqliteTable's database
+        with span('query', conditions=len(self.active_conditions(extra)), sort=self.sort) as timed:
+            row_ids = self.match(extra, conn)
+            timed.set(rows=len(row_ids))
+        return row_ids
+
+    def match(self, extra, conn=None):
+        conditions = self.active_conditions(extra)
+        if isinstance(self.table, SqliteTable):
+            return self.run_sql(conditions, conn or self.table.conn)
+        table = self.table
+        if not conditions and self.sort is None:
+            return table.row_ids()
+        if len(conditions) == 1 and isinstance(conditions[0], Equals) and self.sort is None:
+            return table.find(conditions[0].column, conditions[0].value)
+        if not conditions:
+            return self.sorted_row_ids()
+        mask = table.alive[:table.size].copy()
+        for condition in conditions:
+            mask &= condition.mask(self)
+        if self.sort is None:
+            return np.flatnonzero(mask).astype(np.int64)
+        order = self.sorted_row_ids()
+        return order[mask[order]]
+
+    def run_sql(self, conditions, conn):
+        clauses, parameters = [], []
+        for condition in conditions:
+            clause, values = condition.sql()
+            clauses.append(f'({clause})')
+            parameters.extend(values)
+        sql = f'SELECT rowid FROM {self.table.name}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        if self.sort is not None:
+            sql += f' ORDER BY {self.sort} IS NULL, {self.sort} {"DESC" if self.descending else "ASC"}, rowid'
+        else:
+            sql += ' ORDER BY rowid'
+        cursor = conn.execute(sql, parameters)
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+
+    def sorted_row_ids(self):
+        # Live rows by the sort column, missing values last either way
+        order, present = self.permutation(self.sort)
+        if not self.descending:
+            return order
+        return np.concatenate((order[:present][::-1], order[present:]))
+
+    def permutation(self, name):
+        # The version is read first: rows appended while this runs on a worker
+        # must not be cached as part of it
+        version = self.table.version
+        cached = self.permutations.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        table = self.table
+        column = table.columns[name]
+        row_ids = table.row_ids()
+        if isinstance(column, IntColumn):
+            missing = ~column.valid[row_ids]
+            order = np.lexsort((column.values[row_ids], missing))
+        else:
+            # Codes are in insertion order, rank them by the text they stand for
+            categories = self.categories(name)
+            ranks = np.empty(len(categories) + 1, dtype=np.int64)
+            ranks[np.argsort(categories, kind='stable')] = np.arange(len(categories))
+            ranks[-1] = len(categories)
+            keys = ranks[column.codes[row_ids]]
+            missing = keys == len(categories)
+            order = np.argsort(keys, kind='stable')
+        order = row_ids[order]
+        present = len(order) - int(missing.sum())
+        self.permutations[name] = (version, order, present)
+        return order, present
+
+    def categories(self, name):
+        return np.array(self.table.columns[name].categories, dtype=object)
+
+    def distinct(self, name):
+        # (distinct values, their lowercase text). For text columns the values
+        # are the dictionary codes, which only ever grow.
+        column = self.table.columns[name]
+        cached = self.distinct_values.get(name)
+        if isinstance(column, IntColumn):
+            version = self.table.version
+            if cached is None or cached[0] != version:
+                size = self.table.size
+                values = np.unique(column.values[:size][column.valid[:size] & self.table.alive[:size]])
+                cached = self.distinct_values[name] = (version, values,
+                                                       pd.Series(values.astype(str), dtype=object))
+        elif cached is None or len(cached[1]) != len(column.categories):
+            known = 0 if cached is None else len(cached[1])
+            added = pd.Series(column.categories[known:], dtype=object).str.lower()
+            texts = added if cached is None else pd.concat([cached[2], added], ignore_index=True)
+            cached = self.distinct_values[name] = (None, np.arange(len(column.categories)), texts)
+        return cached[1], cached[2]
+
+    def isin(self, name, values):
+        # Rows whose value is one of values (dictionary codes for text columns)
+        column = self.table.columns[name]
+        size = self.table.size
+        if isinstance(column, IntColumn):
+            return column.valid[:size] & np.isin(column.values[:size], values)
+        hit = np.zeros(len(column.categories) + 1, dtype=bool)
+        hit[values] = True
+        # Code -1 picks the trailing False
+        return hit[column.codes[:size]]
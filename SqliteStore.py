@@ -0,0 +1,294 @@
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from ColumnStore import ColumnTable, IntColumn, coerce_str, parse_ints
+from CsvLoader import FileJobs, iter_csv_chunks, MAX_PENDING_CHUNKS
+from DataModel import table_schemas, table_indexes, table_primary_keys, table_foreign_keys
+from Profiling import span
+from Validation import KeySet, table_validator
+
+SQL_TYPES = {'int': 'INTEGER', 'str': 'TEXT'}
+# Host parameters per statement, below SQLite's default limit
+MAX_PARAMETERS = 900
+
+
+def connect(path):
+    # Autocommit connection, transactions are opened explicitly
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+@contextmanager
+def reading(path):
+    # A connection of the calling thread's own, e.g. for a query on a worker.
+    # In WAL mode it reads alongside the writes of the app's connection.
+    conn = connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transaction(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def table_order():
+    # Referenced tables first, so the foreign keys hold while importing
+    ordered = []
+
+    def visit(name):
+        if name in ordered:
+            return
+        for parent, _ in table_foreign_keys.get(name, {}).values():
+            if parent != name:
+                visit(parent)
+        ordered.append(name)
+
+    for name in table_schemas:
+        visit(name)
+    return ordered
+
+
+def create_schema(conn):
+    # Tables, keys and indexes are all derived from the DataModel schemas
+    for name in table_order():
+        foreign_keys = table_foreign_keys.get(name, {})
+        definitions = []
+        for column, kind in table_schemas[name].items():
+            definition = f'{column} {SQL_TYPES[kind]}'
+            if column == table_primary_keys.get(name):
+                definition += ' UNIQUE'
+            if column in foreign_keys:
+                parent, parent_column = foreign_keys[column]
+                definition += f' REFERENCES {parent}({parent_column})'
+            definitions.append(definition)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {name} ({", ".join(definitions)})')
+        for column in sorted(set(table_indexes.get(name, [])) | set(foreign_keys)):
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name}_{column} ON {name}({column})')
+
+
+def open_database(path):
+    conn = connect(path)
+    create_schema(conn)
+    return conn
+
+
+def prepared_rows(schema, chunk):
+    # Turns a ColumnTable.prepare chunk back into parameter rows
+    rows, prepared = chunk
+    values = []
+    for column, kind in schema.items():
+        if column not in prepared:
+            values.append([None] * rows)
+        elif kind == 'int':
+            numbers, valid = prepared[column]
+            values.append([number if ok else None for number, ok in zip(numbers.tolist(), valid.tolist())])
+        else:
+            codes, uniques = prepared[column]
+            # Code -1 picks the trailing None
+            lookup = uniques + [None]
+            values.append([lookup[code] for code in codes.tolist()])
+    return list(zip(*values))
+
+
+class SqliteTable:
+    # Same interface as ColumnTable, served by indexed queries on a database
+    # table. Row ids are SQLite rowids, and every change is committed as its
+    # own small transaction, so nothing is ever rewritten wholesale.
+
+    def __init__(self, conn, name, schema):
+        self.conn = conn
+        self.name = name
+        self.schema = dict(schema)
+        self.columns = list(self.schema)
+        self.int_columns = {column: IntColumn(column) for column, kind in self.schema.items() if kind == 'int'}
+        column_list = ', '.join(self.columns)
+        self.insert_sql = f'INSERT INTO {name} ({column_list}) VALUES ({", ".join("?" * len(self.columns))})'
+        self.select_sql = f'SELECT rowid, {column_list} FROM {name}'
+        self.count = 0
+        # Bumped by every change made through the app, as ColumnTable.version
+        self.version = 0
+        self.refresh()
+
+    def __len__(self):
+        return self.count
+
+    def refresh(self):
+        # Picks up rows written by other operators
+        self.count = self.conn.execute(f'SELECT COUNT(*) FROM {self.name}').fetchone()[0]
+
+    def coerce(self, entry):
+        return {column: self.int_columns[column].coerce(entry.get(column)) if column in self.int_columns
+                else coerce_str(entry.get(column)) for column in self.columns}
+
+    def execute(self, sql, parameters=()):
+        # Constraint failures, e.g. a person_id without an OMOP Person, surface as ValueError
+        try:
+            return self.conn.execute(sql, parameters)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"{self.name}: {e}") from e
+
+    def append(self, entry):
+        entry = self.coerce(entry)
+        cursor = self.execute(self.insert_sql, [entry[column] for column in self.columns])
+        self.count += 1
+        self.version += 1
+        return cursor.lastrowid
+
+    def prepare(self, frame):
+        return ColumnTable(self.schema).prepare(frame)
+
+    def extend(self, frame):
+        return self.extend_prepared(self.prepare(frame))
+
+    def extend_prepared(self, chunk):
+        # One transaction per chunk; rowids are consecutive while it holds the write lock
+        rows = prepared_rows(self.schema, chunk)
+        try:
+            with transaction(self.conn):
+                start = self.conn.execute(f'SELECT IFNULL(MAX(rowid), 0) + 1 FROM {self.name}').fetchone()[0]
+                self.conn.executemany(self.insert_sql, rows)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"{self.name}: {e}") from e
+        self.count += len(rows)
+        self.version += 1
+        return range(start, start + len(rows))
+
+    def notify_inserted(self, row_ids):
+        # Rows inserted through another connection, e.g. by SqliteImporter
+        self.count += len(row_ids)
+        self.version += 1
+
+    def update(self, row_id, entry):
+        entry = self.coerce(entry)
+        assignments = ', '.join(f'{column} = ?' for column in self.columns)
+        self.execute(f'UPDATE {self.name} SET {assignments} WHERE rowid = ?',
+                     [entry[column] for column in self.columns] + [int(row_id)])
+        self.version += 1
+
+    def delete(self, row_id):
+        cursor = self.execute(f'DELETE FROM {self.name} WHERE rowid = ?', (int(row_id),))
+        self.count -= cursor.rowcount
+        self.version += 1
+
+    def get(self, row_id):
+        row = self.conn.execute(f'{self.select_sql} WHERE rowid = ?', (int(row_id),)).fetchone()
+        return None if row is None else dict(zip(self.columns, row[1:]))
+
+    def row_ids(self):
+        self.refresh()
+        low, high = self.conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM {self.name}').fetchone()
+        if low is None:
+            return np.zeros(0, dtype=np.int64)
+        if high - low + 1 == self.count:
+            return np.arange(low, high + 1, dtype=np.int64)
+        cursor = self.conn.execute(f'SELECT rowid FROM {self.name} ORDER BY rowid')
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+
+    def find(self, column, value):
+        if column in self.int_columns:
+            try:
+                value = self.int_columns[column].coerce(value)
+            except ValueError:
+                return np.zeros(0, dtype=np.int64)
+        else:
+            value = coerce_str(value)
+        if value is None:
+            cursor = self.conn.execute(f'SELECT rowid FROM {self.name} WHERE {column} IS NULL ORDER BY rowid')
+        else:
+            cursor = self.conn.execute(f'SELECT rowid FROM {self.name} WHERE {column} = ? ORDER BY rowid', (value,))
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+
+    def rows(self, row_ids):
+        row_ids = [int(row_id) for row_id in row_ids]
+        values = {}
+        for start in range(0, len(row_ids), MAX_PARAMETERS):
+            batch = row_ids[start:start + MAX_PARAMETERS]
+            cursor = self.conn.execute(f'{self.select_sql} WHERE rowid IN ({", ".join("?" * len(batch))})', batch)
+            for row in cursor:
+                values[row[0]] = ['' if value is None else value for value in row[1:]]
+        return [values.get(row_id, [''] * len(self.columns)) for row_id in row_ids]
+
+    def values(self, column, row_ids=None):
+        if row_ids is None:
+            series = pd.read_sql_query(f'SELECT {column} FROM {self.name} ORDER BY rowid', self.conn)[column]
+        else:
+            row_ids = [int(row_id) for row_id in row_ids]
+            values = {}
+            for start in range(0, len(row_ids), MAX_PARAMETERS):
+                batch = row_ids[start:start + MAX_PARAMETERS]
+                values.update(self.conn.execute(
+                    f'SELECT rowid, {column} FROM {self.name} WHERE rowid IN ({", ".join("?" * len(batch))})', batch))
+            series = pd.Series([values.get(row_id) for row_id in row_ids], name=column, dtype=object)
+        return series.astype('Int64') if column in self.int_columns else series
+
+    def to_dataframe(self, row_ids=None):
+        if row_ids is None:
+            frame = pd.read_sql_query(f'SELECT {", ".join(self.columns)} FROM {self.name} ORDER BY rowid', self.conn)
+        else:
+            # In the order given, e.g. a sorted view
+            row_ids = [int(row_id) for row_id in row_ids]
+            frames = [pd.DataFrame(columns=['rowid'] + self.columns)]
+            for start in range(0, len(row_ids), MAX_PARAMETERS):
+                batch = row_ids[start:start + MAX_PARAMETERS]
+                frames.append(pd.read_sql_query(
+                    f'{self.select_sql} WHERE rowid IN ({", ".join("?" * len(batch))})', self.conn, params=batch))
+            frame = pd.concat(frames, ignore_index=True).set_index('rowid').reindex(row_ids).reset_index(drop=True)
+        return frame.astype({column: 'Int64' for column in self.int_columns})
+
+
+class SqliteImporter(FileJobs):
+    # Streams CSV files into the database on a single worker thread with its
+    # own connection, referenced tables first. Each chunk is committed as one
+    # transaction and reported as ('rows', table name, inserted row ids).
+    # Rows with bad values, duplicate keys or unknown references are left
+    # out and reported as ('invalid', table name, error records).
+
+    span_name = 'sqlite.import'
+
+    def __init__(self, database, files):
+        # files: list of (table name, path, table schema)
+        order = table_order()
+        super().__init__(sorted(files, key=lambda file: order.index(file[0])), MAX_PENDING_CHUNKS, max_workers=1)
+        self.database = database
+
+    def run_file(self, name, path, schema):
+        conn = connect(self.database)
+        try:
+            table = SqliteTable(conn, name, schema)
+            validator = table_validator(name)
+            existing = {column: KeySet(table.values(column)) for column in validator.unique}
+            parents = {column: KeySet(SqliteTable(conn, parent, table_schemas[parent]).values(parent_column))
+                       for column, (parent, parent_column) in validator.references.items()}
+            rows = 0
+            for chunk in iter_csv_chunks(path):
+                self.check_cancelled()
+                with span('validate', table=name, rows=len(chunk)):
+                    valid, errors = validator.validate(chunk, rows + 1, existing, parents)
+                rows += len(chunk)
+                if len(errors):
+                    self.put('invalid', name, errors)
+                    chunk = chunk[valid]
+                if len(chunk):
+                    with span('sqlite.insert', table=name, rows=len(chunk)):
+                        row_ids = table.extend(chunk)
+                    self.put('rows', name, row_ids)
+                    for column, keys in existing.items():
+                        keys.add(parse_ints(chunk[column]))
+        finally:
+            conn.close()
+        return rows
@@ -0,0 +1,225 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from DataModel import table_schemas
+
+# Share of the dataset's rows per table; miabis gets one biobank per
+# ROWS_PER_BIOBANK rows, within BIOBANKS
+TABLE_SHARES = {
+    'omop_person': 0.1,
+    'sprec': 0.2,
+    'condition_occurrence': 0.4,
+    'procedure_occurrence': 0.3
+}
+ROWS_PER_BIOBANK = 100000
+BIOBANKS = (3, 1000)
+# Rows generated and written at a time, bounds the memory of 10M-row datasets
+CHUNK_ROWS = 500000
+# Clinical events fall in this period
+FIRST_DATE = np.datetime64('2000-01-01')
+DAYS = 25 * 365
+
+COUNTRIES = ['SE', 'DE', 'IT', 'NL', 'FI', 'AT', 'CZ', 'NO']
+SAMPLE_TYPES = ['Whole blood', 'Serum', 'Plasma', 'Urine', 'Saliva', 'Tissue', 'DNA', 'RNA']
+SPREC_TYPES = ['BLD', 'SER', 'PL1', 'URN', 'SAL', 'TIS', 'DNA', 'RNA']
+COLLECTION_TYPES = ['SST', 'EDT', 'CIT', 'HEP', 'PAX', 'ZZZ']
+PRE_CENTRIFUGATION = ['A', 'B', 'C', 'D', 'X']
+POST_CENTRIFUGATION = ['A', 'B', 'C', 'D', 'X']
+STORAGE_TEMPS = ['-80C', '-20C', '2-10C', 'RT', 'LN2']
+# OMOP concept ids: gender, race, ethnicity, EHR record type
+GENDERS = {8507: 'M', 8532: 'F'}
+RACES = [8527, 8516, 8515, 8557, 0]
+ETHNICITIES = [38003563, 38003564]
+EHR_RECORD = 32817
+# Common conditions and procedures (concept id, source code); the rest of
+# the events get rarer concepts, so the groups have a long tail
+CONDITIONS = [(201826, 'E11.9'), (320128, 'I10'), (4329847, 'I21.9'), (255573, 'J44.9'), (4112343, 'J02.9'),
+              (46271022, 'N18.9'), (4180628, 'G30.9'), (432867, 'E78.5'), (317576, 'I25.10'), (80180, 'M19.90')]
+PROCEDURES = [(4163872, '0DTJ4ZZ'), (4230911, '0BH17EZ'), (2109825, '45378'), (4030768, '36415'),
+              (2108115, '93000'), (4125906, '71046')]
+COMMON_EVENTS = 0.7
+RARE_CONCEPTS = 5000
+
+
+def table_sizes(rows):
+    biobanks = int(np.clip(rows // ROWS_PER_BIOBANK, *BIOBANKS))
+    sizes = {'miabis': biobanks}
+    for name, share in TABLE_SHARES.items():
+        sizes[name] = max(1, int(rows * share))
+    for name in table_schemas:
+        sizes.setdefault(name, 0)
+    return sizes
+
+
+def dates(rng, count, first=FIRST_DATE, days=DAYS):
+    return np.datetime_as_string(first + rng.integers(0, days, count).astype('timedelta64[D]'), unit='D')
+
+
+def concepts(rng, count, common, base):
+    # Mostly the common concepts, otherwise one of RARE_CONCEPTS made-up ones above base
+    picks = rng.integers(0, len(common), count)
+    ids = np.array([concept for concept, _ in common], dtype=np.int64)[picks]
+    codes = np.array([code for _, code in common], dtype=object)[picks]
+    rare = rng.random(count) >= COMMON_EVENTS
+    rare_ids = base + rng.integers(0, RARE_CONCEPTS, int(rare.sum()))
+    ids[rare] = rare_ids
+    codes[rare] = [f'R{concept - base:04d}' for concept in rare_ids.tolist()]
+    return ids, codes
+
+
+def miabis_rows(rng, ids, sizes):
+    return {
+        'biobank_id': ids,
+        'biobank_name': [f'Biobank {i}' for i in ids.tolist()],
+        'biobank_acronym': [f'BB{i}' for i in ids.tolist()],
+        'biobank_description': 'Synthetic biobank',
+        'biobank_url': [f'https://biobank{i}.example.org' for i in ids.tolist()],
+        'country': rng.choice(COUNTRIES, len(ids)),
+        'juristic_person': [f'University Hospital {i}' for i in ids.tolist()],
+        'biobank_contact': [f'Contact {i}' for i in ids.tolist()],
+        'biobank_contact_email': [f'contact@biobank{i}.example.org' for i in ids.tolist()],
+    }
+
+
+def omop_person_rows(rng, ids, sizes):
+    genders = rng.choice(list(GENDERS), len(ids))
+    years = rng.integers(1930, 2010, len(ids))
+    months = rng.integers(1, 13, len(ids))
+    days = rng.integers(1, 29, len(ids))
+    return {
+        'person_id': ids,
+        'gender_concept_id': genders,
+        'year_of_birth': years,
+        'month_of_birth': months,
+        'day_of_birth': days,
+        'birth_datetime': pd.Series(years).astype(str) + '-' + pd.Series(months).astype(str).str.zfill(2) + '-'
+                          + pd.Series(days).astype(str).str.zfill(2) + 'T00:00:00',
+        'race_concept_id': rng.choice(RACES, len(ids)),
+        'ethnicity_concept_id': rng.choice(ETHNICITIES, len(ids)),
+        'person_source_value': [f'P{i:09d}' for i in ids.tolist()],
+        'gender_source_value': pd.Series(genders).map(GENDERS),
+        'gender_source_concept_id': 0,
+    }
+
+
+def sprec_rows(rng, ids, sizes):
+    types = rng.integers(0, len(SAMPLE_TYPES), len(ids))
+    collection = rng.choice(COLLECTION_TYPES, len(ids))
+    pre = rng.choice(PRE_CENTRIFUGATION, len(ids))
+    post = rng.choice(POST_CENTRIFUGATION, len(ids))
+    return {
+        'sample_id': ids,
+        'sample_type': np.array(SAMPLE_TYPES, dtype=object)[types],
+        'sprec_code': pd.Series(np.array(SPREC_TYPES, dtype=object)[types]) + '-' + collection + '-' + pre + '-'
+                      + rng.choice(['A', 'B', 'C'], len(ids)) + '-' + post + '-' + rng.choice(['A', 'B'], len(ids))
+                      + '-' + rng.choice(['A', 'B', 'C', 'D'], len(ids)),
+        'collection_type': collection,
+        'pre_ct': pre,
+        'post_ct': post,
+        'storage_temp': rng.choice(STORAGE_TEMPS, len(ids), p=[0.6, 0.2, 0.05, 0.05, 0.1]),
+        'biobank_id': rng.integers(1, sizes['miabis'] + 1, len(ids)),
+        'person_id': rng.integers(1, sizes['omop_person'] + 1, len(ids)),
+    }
+
+
+def condition_occurrence_rows(rng, ids, sizes):
+    concept_ids, codes = concepts(rng, len(ids), CONDITIONS, 40000000)
+    start = FIRST_DATE + rng.integers(0, DAYS, len(ids)).astype('timedelta64[D]')
+    end = start + rng.integers(0, 365, len(ids)).astype('timedelta64[D]')
+    ongoing = rng.random(len(ids)) < 0.3
+    end_dates = pd.Series(np.datetime_as_string(end, unit='D')).mask(ongoing)
+    return {
+        'condition_occurrence_id': ids,
+        'person_id': rng.integers(1, sizes['omop_person'] + 1, len(ids)),
+        'condition_concept_id': concept_ids,
+        'condition_start_date': np.datetime_as_string(start, unit='D'),
+        'condition_end_date': end_dates,
+        'condition_type_concept_id': EHR_RECORD,
+        'condition_source_value': codes,
+        'condition_source_concept_id': 0,
+    }
+
+
+def procedure_occurrence_rows(rng, ids, sizes):
+    concept_ids, codes = concepts(rng, len(ids), PROCEDURES, 41000000)
+    return {
+        'procedure_occurrence_id': ids,
+        'person_id': rng.integers(1, sizes['omop_person'] + 1, len(ids)),
+        'procedure_concept_id': concept_ids,
+        'procedure_date': dates(rng, len(ids)),
+        'procedure_type_concept_id': EHR_RECORD,
+        'quantity': 1,
+        'procedure_source_value': codes,
+        'procedure_source_concept_id': 0,
+    }
+
+
+GENERATORS = {
+    'miabis': miabis_rows,
+    'sprec': sprec_rows,
+    'omop_person': omop_person_rows,
+    'condition_occurrence': condition_occurrence_rows,
+    'procedure_occurrence': procedure_occurrence_rows
+}
+
+
+def generate_chunks(name, sizes, seed=0, chunk_rows=CHUNK_ROWS):
+    # DataFrames of the table's rows with every schema column, ids counting
+    # from 1. Each chunk has its own random stream seeded from seed, the
+    # table and its first row, so chunks can be generated independently.
+    if name not in GENERATORS:
+        # Tables declared in DataModel without a generator are left empty
+        yield pd.DataFrame(columns=list(table_schemas[name]))
+        return
+    table_number = list(table_schemas).index(name)
+    for start in range(0, sizes[name], chunk_rows):
+        count = min(chunk_rows, sizes[name] - start)
+        rng = np.random.default_rng([seed, table_number, start])
+        ids = np.arange(start + 1, start + count + 1, dtype=np.int64)
+        columns = GENERATORS[name](rng, ids, sizes)
+        frame = pd.DataFrame({column: np.asarray(values) if not np.isscalar(values) else values
+                              for column, values in columns.items()}, index=range(count))
+        yield frame.reindex(columns=list(table_schemas[name]))
+
+
+def generate(rows, seed=0):
+    # The whole dataset in memory, for small scales
+    sizes = table_sizes(rows)
+    return {name: pd.concat(generate_chunks(name, sizes, seed), ignore_index=True) for name in table_schemas}
+
+
+def write_dataset(directory, rows, seed=0, sep=';'):
+    # Writes <table>_data.csv files as saved by the app; returns the rows per table
+    os.makedirs(directory, exist_ok=True)
+    sizes = table_sizes(rows)
+    for name in table_schemas:
+        path = os.path.join(directory, f'{name}_data.csv')
+        with open(path + '.tmp', 'w', newline='') as f:
+            for number, chunk in enumerate(generate_chunks(name, sizes, seed)):
+                chunk.to_csv(f, sep=sep, index=False, header=number == 0)
+        os.replace(path + '.tmp', path)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic, schema-valid biobank dataset as CSV files")
+    parser.add_argument('--rows', type=int, default=100000, help="total rows over all tables, e.g. 10000 to 10000000")
+    parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed gives the same data")
+    parser.add_argument('--out-dir', default='.', help="directory for the <table>_data.csv files")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sizes = write_dataset(args.out_dir, args.rows, args.seed)
+    for name, rows in sizes.items():
+        print(f"{name:>22} {rows:>10}")
+    print(f"{sum(sizes.values())} rows written to {args.out_dir} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
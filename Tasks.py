@@ -0,0 +1,160 @@
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Tk is polled for task events this often and handles them for at most
+# SLICE_SECONDS before yielding, so the window keeps redrawing
+POLL_MS = 20
+SLICE_SECONDS = 0.03
+# Coalesced refreshes run at most once per frame
+FRAME_MS = 16
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task:
+    # Event queue of one background job, drained by its owner with poll().
+    # Workers queue (kind, name, payload) events and stop at the next check
+    # once the task is cancelled. With max_pending, workers wait while that
+    # many events are still undelivered.
+
+    def __init__(self, max_pending=0):
+        # Events are queued as (counted, event); counted ones hold one of the
+        # max_pending places until delivered
+        self.events = queue.Queue()
+        self.places = threading.Semaphore(max_pending) if max_pending else None
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def put(self, kind, name, payload):
+        if self.places is not None:
+            while not self.places.acquire(timeout=0.1):
+                self.check_cancelled()
+        self.events.put((self.places is not None, (kind, name, payload)))
+
+    def put_final(self, kind, name, payload):
+        # Queued even when the task was cancelled, e.g. the end of one of its
+        # jobs. Never waits for a place: after shutdown no one drains the
+        # queue any more.
+        self.events.put((False, (kind, name, payload)))
+
+    def finish(self, kind, name, payload):
+        # The last event of the task
+        self.put_final(kind, name, payload)
+        self.finished.set()
+
+    def poll(self):
+        # Non-blocking: returns the next event or None
+        try:
+            counted, event = self.events.get_nowait()
+        except queue.Empty:
+            return None
+        if counted:
+            self.places.release()
+        return event
+
+    def is_finished(self):
+        return self.finished.is_set() and self.events.empty()
+
+
+class FunctionTask(Task):
+    # Runs function(task, *args) on a worker. The function may report
+    # ('progress', name, payload) events through task.put; the task ends with
+    # 'result', 'error' or 'cancelled'.
+
+    def __init__(self, function, args, name=None):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.name = name
+
+    def start(self, executor):
+        executor.submit(self.run)
+        return self
+
+    def run(self):
+        try:
+            result = self.function(self, *self.args)
+        except Cancelled:
+            self.finish('cancelled', self.name, None)
+        except Exception as e:
+            self.finish('error', self.name, e)
+        else:
+            self.finish('result', self.name, result)
+
+
+class TaskRunner:
+    # Worker pool shared by the app. The events of watched tasks are handed
+    # to their handlers on the Tk thread by a root.after loop, which only runs
+    # while tasks are active.
+
+    def __init__(self, root, max_workers=None):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.handlers = {}
+        self.polling = None
+        self.frames = {}
+
+    def submit(self, function, *args, name=None, on_result=None, on_error=None, on_progress=None):
+        def handle(kind, name, payload):
+            callback = {'result': on_result, 'error': on_error, 'progress': on_progress}.get(kind)
+            if callback is not None:
+                callback(payload)
+
+        task = FunctionTask(function, args, name).start(self.executor)
+        self.watch(task, handle)
+        return task
+
+    def watch(self, task, handler):
+        # handler(kind, name, payload) is called on the Tk thread for every event
+        self.handlers[task] = handler
+        if self.polling is None:
+            self.polling = self.root.after(POLL_MS, self.poll)
+
+    def poll(self):
+        self.polling = None
+        try:
+            deadline = time.perf_counter() + SLICE_SECONDS
+            for task, handler in list(self.handlers.items()):
+                while time.perf_counter() < deadline:
+                    event = task.poll()
+                    if event is None:
+                        break
+                    try:
+                        handler(*event)
+                    except Exception:
+                        # Reported like any Tk callback error, the task's
+                        # later events are still delivered
+                        self.root.report_callback_exception(*sys.exc_info())
+                if task.is_finished():
+                    del self.handlers[task]
+        finally:
+            if self.handlers and self.polling is None:
+                self.polling = self.root.after(POLL_MS, self.poll)
+
+    def coalesce(self, key, callback, *args):
+        # However often it is requested, callback runs once in the next frame,
+        # with the arguments of the latest request
+        pending = self.frames.get(key)
+        after_id = pending[0] if pending is not None else self.root.after(FRAME_MS, self.run_frame, key)
+        self.frames[key] = (after_id, callback, args)
+
+    def run_frame(self, key):
+        _, callback, args = self.frames.pop(key)
+        callback(*args)
+
+    def shutdown(self):
+        for task in self.handlers:
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,205 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from ColumnStore import parse_ints
+from DataModel import table_schemas, table_primary_keys, table_foreign_keys
+
+DATE_FORMAT = '%Y-%m-%d'
+ERROR_COLUMNS = ['row', 'column', 'value', 'message']
+
+
+def sorted_unique(values):
+    # np.unique of int64 keys, by one sort instead of its much slower hashing
+    values = np.sort(values)
+    if len(values):
+        values = values[np.concatenate(([True], values[1:] != values[:-1]))]
+    return values
+
+
+class KeySet:
+    # Sorted distinct key values. Membership of a whole column is one binary
+    # search per value, and added keys are merged without re-sorting.
+
+    def __init__(self, values=()):
+        self.values = self.distinct(values)
+        # values is a prefix of this array while keys are appended in order
+        self.buffer = None
+
+    @staticmethod
+    def distinct(values):
+        values = pd.Series(values).dropna()
+        if pd.api.types.is_numeric_dtype(values.dtype):
+            return sorted_unique(values.to_numpy(dtype=np.int64))
+        return np.unique(values.to_numpy(dtype=object))
+
+    @classmethod
+    def of(cls, values):
+        return values if isinstance(values, KeySet) else cls(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def contains(self, keys):
+        keys = np.asarray(keys)
+        if not len(self.values):
+            return np.zeros(len(keys), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.values, keys), len(self.values) - 1)
+        return self.values[positions] == keys
+
+    def add(self, keys):
+        keys = self.distinct(keys)
+        size = len(self.values)
+        if size and len(keys) and keys.dtype == self.values.dtype and keys[0] > self.values[-1]:
+            # All past the largest key, as the ids read from a file usually
+            # are: appended into spare room instead of copying the whole set
+            if self.buffer is None or size + len(keys) > len(self.buffer):
+                self.buffer = np.empty(2 * (size + len(keys)), dtype=self.values.dtype)
+                self.buffer[:size] = self.values
+            self.buffer[size:size + len(keys)] = keys
+            self.values = self.buffer[:size + len(keys)]
+            return
+        keys = keys[~self.contains(keys)]
+        self.values = np.insert(self.values, np.searchsorted(self.values, keys), keys)
+        self.buffer = None
+
+
+class SchemaValidator:
+    # Column-at-a-time checks of text frames against a DataModel schema.
+    # The checks are worked out once per schema; validate() returns a mask of
+    # the rows that passed plus one error record per failed (row, column)
+    # instead of stopping at the first one.
+
+    def __init__(self, schema, required=(), unique=(), references=None):
+        # references: {column: (referenced table, referenced column)}
+        self.schema = dict(schema)
+        self.required = [column for column in required if column in self.schema]
+        self.unique = [column for column in unique if column in self.schema]
+        self.references = dict(references or {})
+        self.checks = []
+        for column, kind in self.schema.items():
+            checks = []
+            if column in self.required:
+                checks.append(self.check_required)
+            if kind == 'int':
+                checks.append(self.check_int)
+            elif column.endswith('_date'):
+                checks.append(self.check_date)
+            if checks or column in self.unique or column in self.references:
+                self.checks.append((column, checks))
+
+    def validate(self, frame, first_row=0, existing=None, parents=None):
+        # existing: {unique column: values already stored}
+        # parents: {referencing column: values of the referenced column};
+        # both take a KeySet or any sequence of values. References without
+        # known parent values are not checked.
+        existing = existing or {}
+        parents = parents or {}
+        rows = len(frame)
+        valid = np.ones(rows, dtype=bool)
+        errors = []
+        for column, checks in self.checks:
+            if column not in frame:
+                if column in self.required:
+                    self.fail(valid, errors, np.ones(rows, dtype=bool), column, None,
+                              "missing required column", first_row)
+                continue
+            values = frame[column].reset_index(drop=True)
+            blank = values.isna().to_numpy(dtype=bool, copy=True)
+            if pd.api.types.is_string_dtype(values.dtype):
+                blank |= (values.str.strip() == '').to_numpy(dtype=bool)
+            numbers = parse_ints(values) if self.schema[column] == 'int' else None
+            for check in checks:
+                check(valid, errors, column, values, blank, numbers, first_row)
+            if column in self.unique or column in self.references:
+                self.check_keys(valid, errors, column, values, blank, numbers, first_row, existing, parents)
+        if errors:
+            errors = pd.concat(errors, ignore_index=True).sort_values('row', kind='stable', ignore_index=True)
+        else:
+            errors = pd.DataFrame(columns=ERROR_COLUMNS)
+        return valid, errors
+
+    def check_required(self, valid, errors, column, values, blank, numbers, first_row):
+        self.fail(valid, errors, blank, column, values, "required value is missing", first_row)
+
+    def check_int(self, valid, errors, column, values, blank, numbers, first_row):
+        bad = numbers.isna().to_numpy() & ~blank
+        self.fail(valid, errors, bad, column, values, "expected an integer", first_row)
+
+    def check_date(self, valid, errors, column, values, blank, numbers, first_row):
+        dates = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+        bad = dates.isna().to_numpy() & ~blank
+        self.fail(valid, errors, bad, column, values, "expected a date as YYYY-MM-DD", first_row)
+
+    def check_keys(self, valid, errors, column, values, blank, numbers, first_row, existing, parents):
+        if numbers is not None:
+            keys = numbers
+        else:
+            keys = values.where(~blank)
+        present = keys.notna().to_numpy()
+        if numbers is not None:
+            present_keys = keys[present].to_numpy(dtype=np.int64)
+        else:
+            present_keys = keys[present].str.strip().to_numpy()
+
+        def flag(found):
+            bad = np.zeros(len(values), dtype=bool)
+            bad[present] = found
+            return bad
+
+        if column in self.unique:
+            bad = present & keys.duplicated().to_numpy()
+            if column in existing:
+                bad |= flag(KeySet.of(existing[column]).contains(present_keys))
+            self.fail(valid, errors, bad, column, values, "duplicate key", first_row)
+        if column in parents:
+            parent, parent_column = self.references[column]
+            bad = flag(~KeySet.of(parents[column]).contains(present_keys))
+            self.fail(valid, errors, bad, column, values, f"no {parent} with this {parent_column}", first_row)
+
+    @staticmethod
+    def fail(valid, errors, bad, column, values, message, first_row):
+        if bad.any():
+            positions = np.flatnonzero(bad)
+            valid[positions] = False
+            errors.append(pd.DataFrame({'row': positions + first_row, 'column': column,
+                                        'value': None if values is None else values.iloc[positions].to_numpy(),
+                                        'message': message}))
+
+
+@lru_cache(maxsize=None)
+def table_validator(name):
+    key = table_primary_keys.get(name)
+    return SchemaValidator(table_schemas[name], required=[key] if key else [], unique=[key] if key else [],
+                           references=table_foreign_keys.get(name))
+
+
+def check_references(tables):
+    # Rows of already loaded tables whose keys have no referenced row.
+    # tables: {table name: ColumnTable or SqliteTable}
+    errors = []
+    for name, data in tables.items():
+        for column, (parent, parent_column) in table_foreign_keys.get(name, {}).items():
+            if parent not in tables:
+                continue
+            values = data.values(column).reset_index(drop=True)
+            bad = (values.notna() & ~values.isin(tables[parent].values(parent_column).dropna())).to_numpy(dtype=bool)
+            if bad.any():
+                positions = np.flatnonzero(bad)
+                errors.append(pd.DataFrame({'table': name, 'row': positions + 1, 'column': column,
+                                            'value': values.iloc[positions].to_numpy(),
+                                            'message': f"no {parent} with this {parent_column}"}))
+    return pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=['table'] + ERROR_COLUMNS)
+
+
+def error_lines(errors, limit=10):
+    # Readable lines for a message box, one per problem
+    lines = []
+    for error in errors.head(limit).itertuples(index=False):
+        table = f"{error.table} " if 'table' in errors else ''
+        value = '' if pd.isna(error.value) or error.value == '' else f" ({error.value!r})"
+        lines.append(f"{table}row {error.row}, {error.column}: {error.message}{value}")
+    if len(errors) > limit:
+        lines.append(f"... and {len(errors) - limit} more")
+    return lines
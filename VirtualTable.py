@@ -0,0 +1,242 @@
+from tkinter import ttk
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from Profiling import span
+
+
+class VirtualTreeview(ttk.Treeview):
+    # Treeview that only materializes the rows currently in view. The rows
+    # themselves stay in the backing store and are fetched page by page
+    # through the `fetch` callback while the user scrolls.
+
+    def __init__(self, master, page_size=200, cached_pages=8, **kw):
+        self._yscrollcommand = kw.pop('yscrollcommand', None)
+        super().__init__(master, **kw)
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self._keys = array('q')
+        self._ascending = True
+        self._fetch = None
+        self._pages = OrderedDict()
+        self._offset = 0
+        self._visible_rows = int(self.cget('height')) or 10
+        self._slots = []
+        self._slot_keys = []
+        self._selected = set()
+
+        self.bind('<Configure>', self._on_configure, add='+')
+        self.bind('<<TreeviewSelect>>', self._on_select, add='+')
+        self.bind('<MouseWheel>', self._on_mousewheel)
+        self.bind('<Button-4>', lambda e: self._scroll_and_break(-3))
+        self.bind('<Button-5>', lambda e: self._scroll_and_break(3))
+        self.bind('<Up>', lambda e: self._scroll_and_break(-1))
+        self.bind('<Down>', lambda e: self._scroll_and_break(1))
+        self.bind('<Prior>', lambda e: self._scroll_and_break(-self._visible_rows))
+        self.bind('<Next>', lambda e: self._scroll_and_break(self._visible_rows))
+        self.bind('<Home>', lambda e: self._scroll_and_break(-len(self._keys)))
+        self.bind('<End>', lambda e: self._scroll_and_break(len(self._keys)))
+
+    def set_source(self, keys, fetch, ascending=True):
+        # keys: integer row keys to display, in display order
+        # fetch: callable returning one list of values per key it is given
+        # ascending: whether keys are sorted, e.g. not for a table sorted by a column
+        self._keys = self._as_keys(keys)
+        self._ascending = ascending
+        self._fetch = fetch
+        self._pages.clear()
+        self._selected.clear()
+        self._offset = 0
+        self.refresh()
+
+    def refresh(self):
+        with span('treeview.refresh') as timed:
+            total = len(self._keys)
+            self._offset = max(0, min(self._offset, total - self._visible_rows))
+            rows = self._rows(self._offset, min(self._offset + self._visible_rows, total))
+
+            # Reuse the existing items, only the surplus is created or deleted
+            while len(self._slots) < len(rows):
+                self._slots.append(super().insert('', 'end'))
+            while len(self._slots) > len(rows):
+                super().delete(self._slots.pop())
+            self._slot_keys = list(self._keys[self._offset:self._offset + len(rows)])
+            for iid, values in zip(self._slots, rows):
+                super().item(iid, values=values)
+
+            super().selection_set([iid for iid, key in zip(self._slots, self._slot_keys) if key in self._selected])
+            self._update_scrollbar()
+            timed.set(rows=len(rows))
+
+    def append_row(self, key, see=False):
+        # Row-level patches only touch the Treeview items of the rows in view
+        if not self._keys or not self._ascending or key > self._keys[-1]:
+            pos = len(self._keys)
+            self._keys.append(key)
+        else:
+            pos = bisect_left(self._keys, key)
+            self._keys.insert(pos, key)
+        self._invalidate_pages(pos)
+        if see:
+            self._offset = max(0, pos - self._visible_rows + 1)
+        if see or pos < self._offset + self._visible_rows:
+            self.refresh()
+        else:
+            self._update_scrollbar()
+
+    def extend_rows(self, keys):
+        keys = self._as_keys(keys)
+        if not keys:
+            return
+        pos = len(self._keys)
+        if self._keys and self._ascending and keys[0] <= self._keys[-1]:
+            pos = bisect_left(self._keys, keys[0])
+            self._keys = array('q', sorted(set(self._keys) | set(keys)))
+        else:
+            self._keys.extend(keys)
+        self._invalidate_pages(pos)
+        if pos < self._offset + self._visible_rows:
+            self.refresh()
+        else:
+            self._update_scrollbar()
+
+    def update_row(self, key):
+        pos = self._position(key)
+        if pos is None:
+            return
+        self._pages.pop(pos // self.page_size, None)
+        slot = pos - self._offset
+        if 0 <= slot < len(self._slots):
+            super().item(self._slots[slot], values=self._fetch([key])[0])
+
+    def delete_row(self, key):
+        pos = self._position(key)
+        if pos is None:
+            return
+        del self._keys[pos]
+        self._selected.discard(key)
+        self._invalidate_pages(pos)
+        if pos < self._offset + self._visible_rows:
+            self.refresh()
+        else:
+            self._update_scrollbar()
+
+    def scroll_rows(self, count):
+        offset = max(0, min(self._offset + count, len(self._keys) - self._visible_rows))
+        if offset != self._offset:
+            self._offset = offset
+            self.refresh()
+
+    def row_count(self):
+        return len(self._keys)
+
+    def row_keys(self):
+        # Copy of the displayed row keys, in display order
+        return array('q', self._keys)
+
+    def selected_keys(self):
+        return sorted(self._selected)
+
+    def yview(self, *args):
+        total = len(self._keys)
+        if not args:
+            if not total:
+                return 0.0, 1.0
+            return self._offset / total, min(1.0, (self._offset + self._visible_rows) / total)
+        if args[0] == 'moveto':
+            self.scroll_rows(int(float(args[1]) * total) - self._offset)
+        elif args[0] == 'scroll':
+            step = self._visible_rows if args[2] == 'pages' else 1
+            self.scroll_rows(int(args[1]) * step)
+
+    def configure(self, cnf=None, **kw):
+        # The vertical scrollbar follows the virtual rows, not the Treeview items
+        if 'yscrollcommand' in kw:
+            self._yscrollcommand = kw.pop('yscrollcommand')
+            self._update_scrollbar()
+            if not kw and cnf is None:
+                return None
+        return super().configure(cnf, **kw)
+
+    config = configure
+
+    @staticmethod
+    def _as_keys(keys):
+        # Buffers such as NumPy int64 arrays are copied in bulk
+        try:
+            view = memoryview(keys)
+        except TypeError:
+            return array('q', keys)
+        if view.itemsize != 8:
+            return array('q', keys)
+        return array('q', view.cast('B').tobytes())
+
+    def _position(self, key):
+        if not self._ascending:
+            try:
+                return self._keys.index(key)
+            except ValueError:
+                return None
+        pos = bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return pos
+        return None
+
+    def _invalidate_pages(self, pos):
+        first_page = pos // self.page_size
+        for page in [page for page in self._pages if page >= first_page]:
+            del self._pages[page]
+
+    def _rows(self, start, stop):
+        rows = []
+        if start >= stop:
+            return rows
+        for page in range(start // self.page_size, (stop - 1) // self.page_size + 1):
+            page_start = page * self.page_size
+            page_rows = self._page(page)
+            rows.extend(page_rows[max(start - page_start, 0):stop - page_start])
+        return rows
+
+    def _page(self, page):
+        if page in self._pages:
+            self._pages.move_to_end(page)
+            return self._pages[page]
+        page_keys = self._keys[page * self.page_size:(page + 1) * self.page_size]
+        rows = self._fetch(page_keys) if len(page_keys) else []
+        self._pages[page] = rows
+        if len(self._pages) > self.cached_pages:
+            self._pages.popitem(last=False)
+        return rows
+
+    def _update_scrollbar(self):
+        if self._yscrollcommand is not None:
+            self._yscrollcommand(*self.yview())
+
+    def _measure_visible_rows(self):
+        row_height = 20
+        header_height = 24
+        if self._slots:
+            bbox = super().bbox(self._slots[0])
+            if bbox:
+                header_height, row_height = bbox[1], bbox[3]
+        return max(1, (self.winfo_height() - header_height) // row_height)
+
+    def _on_configure(self, event):
+        visible_rows = self._measure_visible_rows()
+        if visible_rows != self._visible_rows:
+            self._visible_rows = visible_rows
+            self.refresh()
+
+    def _on_select(self, event):
+        visible = dict(zip(self._slots, self._slot_keys))
+        self._selected.difference_update(visible.values())
+        self._selected.update(visible[iid] for iid in super().selection() if iid in visible)
+
+    def _on_mousewheel(self, event):
+        step = -event.delta // 120 if abs(event.delta) >= 120 else -event.delta
+        return self._scroll_and_break(step * 3)
+
+    def _scroll_and_break(self, count):
+        self.scroll_rows(count)
+        return 'break'
@@ -0,0 +1,40 @@
+import pandas as pd
+
+from BulkImport import bulk_import
+from DataModel import table_schemas
+
+COLUMNS = list(table_schemas['miabis'])
+
+
+def row(biobank_id, name, columns=COLUMNS):
+    values = {'biobank_id': str(biobank_id), 'biobank_name': name}
+    return ';'.join(values.get(column, '') for column in columns)
+
+
+def import_rows(tmp_path, stored):
+    # Imports biobanks 2 and 3 next to a miabis_data.csv holding the lines stored
+    (tmp_path / 'miabis_data.csv').write_text(''.join(line + '\n' for line in stored))
+    extract = tmp_path / 'extract.csv'
+    extract.write_text('\n'.join([';'.join(COLUMNS), row(2, 'B'), row(3, 'C')]) + '\n')
+    [result] = bulk_import([('miabis', str(extract))], directory=str(tmp_path))
+    assert result['failure'] is None and result['accepted'] == 2
+    return pd.read_csv(tmp_path / 'miabis_data.csv', sep=';', dtype=str, keep_default_na=False)
+
+
+def test_rows_are_appended_below_the_same_header(tmp_path):
+    frame = import_rows(tmp_path, [';'.join(COLUMNS), row('01', 'A')])
+    assert list(frame.columns) == COLUMNS
+    assert frame[['biobank_id', 'biobank_name']].values.tolist() == [['01', 'A'], ['2', 'B'], ['3', 'C']]
+
+
+def test_file_with_other_columns_is_rewritten(tmp_path):
+    columns = [COLUMNS[1], COLUMNS[0]] + COLUMNS[2:-1]
+    frame = import_rows(tmp_path, [';'.join(columns), row(1, 'A', columns)])
+    assert list(frame.columns) == COLUMNS
+    assert frame[['biobank_id', 'biobank_name']].values.tolist() == [['1', 'A'], ['2', 'B'], ['3', 'C']]
+
+
+def test_empty_file_is_rewritten(tmp_path):
+    frame = import_rows(tmp_path, [''])
+    assert list(frame.columns) == COLUMNS
+    assert frame[['biobank_id', 'biobank_name']].values.tolist() == [['2', 'B'], ['3', 'C']]
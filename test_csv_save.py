@@ -0,0 +1,109 @@
+import pytest
+
+import HeadlessTk
+
+# The stand-in has to be registered as tkinter before the app is imported
+tk = HeadlessTk.install()
+
+import BiobankApp as app_module  # noqa: E402
+from Benchmark import MessageLog  # noqa: E402
+from DataModel import table_schemas  # noqa: E402
+
+COLUMNS = list(table_schemas['miabis'])
+PATH = 'miabis_data.csv'
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # An app on a directory of empty table files, as saved from empty tables
+    monkeypatch.chdir(tmp_path)
+    for name in table_schemas:
+        (tmp_path / f'{name}_data.csv').write_text('\n')
+    log = MessageLog()
+    monkeypatch.setattr(app_module, 'messagebox', log)
+    app = app_module.BiobankApp(tk.Tk())
+    app.root.update()
+    app.log = log
+    yield app
+    app.tasks.shutdown()
+
+
+def run(app, function):
+    return app.log.run(app.root, function, timeout=60)
+
+
+def write(lines):
+    with open(PATH, 'w', newline='') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+def read():
+    with open(PATH, newline='') as f:
+        return f.read().splitlines()
+
+
+def row(biobank_id, name):
+    return ';'.join([str(biobank_id), name] + [''] * (len(COLUMNS) - 2))
+
+
+def add(app, biobank_id, name):
+    app.table_data('miabis').append({'biobank_id': biobank_id, 'biobank_name': name})
+
+
+def loaded(app):
+    # (biobank_id, biobank_name) of the miabis rows after loading the files again
+    run(app, app.load_from_csv)
+    data = app.table_data('miabis')
+    return [(data.get(row_id)['biobank_id'], data.get(row_id)['biobank_name']) for row_id in data.row_ids()]
+
+
+def test_added_rows_are_appended(app):
+    # The leading zero would not survive a rewrite
+    write([';'.join(COLUMNS), row('01', 'A')])
+    run(app, app.load_from_csv)
+    add(app, 2, 'B')
+    run(app, app.save_to_csv)
+    assert read() == [';'.join(COLUMNS), row('01', 'A'), row(2, 'B')]
+    assert loaded(app) == [(1, 'A'), (2, 'B')]
+
+
+def test_file_with_other_columns_is_rewritten(app):
+    # Two columns swapped and the last one missing
+    columns = [COLUMNS[1], COLUMNS[0]] + COLUMNS[2:-1]
+    write([';'.join(columns), ';'.join(['A', '1'] + [''] * (len(columns) - 2))])
+    run(app, app.load_from_csv)
+    add(app, 2, 'B')
+    run(app, app.save_to_csv)
+    assert read() == [';'.join(COLUMNS), row(1, 'A'), row(2, 'B')]
+    assert loaded(app) == [(1, 'A'), (2, 'B')]
+
+
+def test_empty_file_is_rewritten(app):
+    run(app, app.load_from_csv)
+    add(app, 2, 'B')
+    run(app, app.save_to_csv)
+    assert read() == [';'.join(COLUMNS), row(2, 'B')]
+    assert loaded(app) == [(2, 'B')]
+
+
+def test_file_changed_since_load_is_rewritten_by_next_save(app):
+    write([';'.join(COLUMNS), row(1, 'A')])
+    run(app, app.load_from_csv)
+    write([';'.join(reversed(COLUMNS)), ';'.join(reversed(row(1, 'A').split(';')))])
+    add(app, 2, 'B')
+    with pytest.raises(RuntimeError, match='no longer has'):
+        run(app, app.save_to_csv)
+    run(app, app.save_to_csv)
+    assert read() == [';'.join(COLUMNS), row(1, 'A'), row(2, 'B')]
+
+
+def test_partial_table_needing_a_rewrite_is_not_saved(app):
+    columns = [COLUMNS[1], COLUMNS[0]] + COLUMNS[2:]
+    write([';'.join(columns), ';'.join(['A', '1'] + [''] * (len(columns) - 2))])
+    run(app, app.load_from_csv)
+    # As after a cancelled load
+    app.table_data('miabis').mark_loaded(partial=True)
+    add(app, 2, 'B')
+    app.save_to_csv()
+    assert app.log.messages[-1][0] == 'error' and 'partially loaded' in app.log.messages[-1][1]
+    assert read()[0] == ';'.join(columns) and len(read()) == 2
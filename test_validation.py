@@ -0,0 +1,32 @@
+import pandas as pd
+
+from ColumnStore import ColumnTable, parse_ints
+from DataModel import table_schemas
+from Validation import KeySet, table_validator
+
+# Adjacent ids past 2**53, a float64 holds both as the same number
+BIG = 2 ** 53 + 1
+
+
+def test_parse_ints_is_exact():
+    numbers = parse_ints(pd.Series([str(BIG), str(BIG - 1), '', None, ' 7 ', '2.0', '2.5', 'x']))
+    assert numbers.tolist() == [BIG, BIG - 1, pd.NA, pd.NA, 7, 2, pd.NA, pd.NA]
+
+
+def test_large_keys_are_not_duplicates():
+    frame = pd.DataFrame({'person_id': [str(BIG), str(BIG - 1)]}).reindex(columns=list(table_schemas['omop_person']))
+    valid, errors = table_validator('omop_person').validate(frame, 1, {'person_id': KeySet()})
+    assert valid.all() and not len(errors)
+
+
+def test_large_key_finds_its_parent():
+    frame = pd.DataFrame({'condition_occurrence_id': ['1'], 'person_id': [str(BIG)],
+                          'condition_concept_id': ['1'], 'condition_start_date': ['2024-01-31']})
+    valid, errors = table_validator('condition_occurrence').validate(frame, 1, {}, {'person_id': KeySet([BIG - 1, BIG])})
+    assert valid.all(), errors
+
+
+def test_large_ids_are_stored_exactly():
+    table = ColumnTable(table_schemas['omop_person'])
+    table.extend(pd.DataFrame({'person_id': [str(BIG), '']}).reindex(columns=list(table_schemas['omop_person'])))
+    assert [table.get(0)['person_id'], table.get(1)['person_id']] == [BIG, None]